@@ -3,9 +3,19 @@ import pandas as pd
 import numpy as np
 from tqdm import tqdm
 import networkx as nx
+import pyogrio
+import shapely
 from shapely.geometry import Point
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 import gc
+import os
+import pickle
+
+from River_rebuild import topological_levels
+from geo_io import write_table
 
 # Paths
 streams_path = "DEM/outputs/streams_cleaned_final.shp"
@@ -15,7 +25,22 @@ basin_paths = [
     "D:/Dissertation/Core/hybas4_selected_subbasin_3.shp",
     "D:/Dissertation/Core/hybas4_selected_subbasin_4.shp"
 ]
-output_path = "DEM/outputs/streams_reconstructed_topo.shp"
+output_path = "DEM/outputs/streams_reconstructed_topo.parquet"  # .shp/.gpkg also work
+basin_index_cache = "DEM/outputs/basin_index_cache.pkl"
+
+# Primary-basin rule for segments touching several basins: "midpoint" or "overlap"
+basin_assignment_rule = "midpoint"
+
+# Connectivity backend: "sparse" (array keys + scipy connected_components)
+# or "dict" (coordinate dictionary + Python union-find)
+connectivity_backend = "sparse"
+
+# Parallel basin processing: 1 runs basins serially, None uses every core
+n_workers = 1
+max_gb_per_worker = None  # address-space cap per worker process (Unix only)
+
+# Streaming ingest: read streams in batches of this many features (None loads the whole file)
+chunk_size = None
 
 def load_basin_data(basin_paths):
     """Load and combine all basin shapefiles"""
@@ -38,70 +63,114 @@ def load_basin_data(basin_paths):
     else:
         raise ValueError("No basin files could be loaded")
 
-def fast_extract_endpoints(geometries, precision=6):
-    """Ultra-fast coordinate extraction using vectorized operations"""
-    print("Fast coordinate extraction...")
-    
-    # Get all coordinates as a single array
-    coords_df = geometries.get_coordinates()
+def load_basin_index(basin_paths, crs, cache_path=None):
+    """Basin geometries, basin_group numbers and STRtree in the streams' CRS.
+
+    The reprojected geometries are cached as WKB keyed by the source files'
+    size and modification time and the target CRS, so repeated runs over the
+    same HydroBASINS tiles skip reading and reprojecting them.
+    """
+    signature = [(path, os.path.getsize(path), os.path.getmtime(path))
+                 for path in basin_paths if os.path.exists(path)]
+    signature.append(str(crs))
+    
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("signature") == signature:
+            print(f"Using cached basin index: {cache_path}")
+            geoms = shapely.from_wkb(cached["wkb"])
+            return geoms, cached["groups"], shapely.STRtree(geoms)
     
-    # Group by geometry index
-    grouped = coords_df.groupby(level=0)
+    basins_gdf = load_basin_data(basin_paths)
+    if basins_gdf.crs != crs:
+        print(f"Reprojecting basins from {basins_gdf.crs} to {crs}")
+        basins_gdf = basins_gdf.to_crs(crs)
+    geoms = basins_gdf.geometry.values.to_numpy()
+    groups = basins_gdf['basin_group'].to_numpy()
+    
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump({"signature": signature, "wkb": shapely.to_wkb(geoms), "groups": groups}, f)
+    
+    return geoms, groups, shapely.STRtree(geoms)
+
+def assign_streams_to_basins(geometries, basin_geoms, basin_groups, tree, rule="midpoint"):
+    """Exactly one basin_group per segment (0 where no basin is touched).
+
+    "midpoint" assigns the basin containing the segment's midpoint, falling
+    back to the largest overlap when the midpoint lies outside every basin.
+    "overlap" always picks the basin holding the longest part of the segment.
+    Candidate tests run in bulk through the STRtree, which prepares the
+    basin polygons for its predicates.
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    assigned = np.zeros(len(geoms), dtype=int)
+    
+    if rule == "midpoint":
+        midpoints = shapely.line_interpolate_point(geoms, 0.5, normalized=True)
+        seg, basin = tree.query(midpoints, predicate="intersects")
+        # A midpoint on a shared boundary hits two basins; keep the first listed
+        order = np.lexsort((basin, seg))
+        seg, basin = seg[order], basin[order]
+        seg, first = np.unique(seg, return_index=True)
+        assigned[seg] = basin_groups[basin[first]]
+        remaining = np.flatnonzero(assigned == 0)
+    elif rule == "overlap":
+        remaining = np.arange(len(geoms))
+    else:
+        raise ValueError(f"Unknown basin assignment rule: {rule}")
+    
+    if len(remaining):
+        seg, basin = tree.query(geoms[remaining], predicate="intersects")
+        seg = remaining[seg]
+        overlap = shapely.length(shapely.intersection(geoms[seg], basin_geoms[basin]))
+        # Longest overlap first within each segment, ties to the first listed basin
+        order = np.lexsort((basin, -overlap, seg))
+        seg, basin = seg[order], basin[order]
+        seg, first = np.unique(seg, return_index=True)
+        assigned[seg] = basin_groups[basin[first]]
+    
+    return assigned
+
+def fast_extract_endpoints(geometries, precision=6, quantize=True):
+    """Vectorized first/last vertex extraction for all LineStrings.
+
+    Returns two (n, 2) arrays. With quantize=True they hold int64 keys
+    (coordinates scaled by 10**precision and rounded) that can be compared
+    exactly; otherwise rounded float coordinates. Missing geometries map to (0, 0).
+    """
+    print("Fast coordinate extraction...")
     
-    start_coords = []
-    end_coords = []
+    geoms = np.asarray(geometries, dtype=object)
+    scale = 10.0 ** precision
     
-    print("Processing coordinate groups...")
-    for geom_idx in tqdm(range(len(geometries)), desc="Extracting endpoints"):
-        if geom_idx in grouped.groups:
-            coords = grouped.get_group(geom_idx).values
-            start = coords[0]
-            end = coords[-1]
-            
-            # Round coordinates
-            start_rounded = (round(start[0], precision), round(start[1], precision))
-            end_rounded = (round(end[0], precision), round(end[1], precision))
-            
-            start_coords.append(start_rounded)
-            end_coords.append(end_rounded)
+    endpoints = []
+    for vertex in (0, -1):
+        points = shapely.get_point(geoms, vertex)
+        coords = np.column_stack([shapely.get_x(points), shapely.get_y(points)])
+        coords = np.nan_to_num(coords, nan=0.0)
+        if quantize:
+            endpoints.append(np.rint(coords * scale).astype(np.int64))
         else:
-            # Handle missing geometry
-            start_coords.append((0, 0))
-            end_coords.append((0, 0))
+            endpoints.append(np.round(coords, precision))
     
+    start_coords, end_coords = endpoints
     return start_coords, end_coords
 
-def process_basin_chunk(basin_streams, starting_river_id):
-    """Process a single basin efficiently"""
-    
-    if len(basin_streams) == 0:
-        return basin_streams
-    
-    print(f"Processing basin with {len(basin_streams)} segments...")
-    
-    # Reset index
-    basin_streams = basin_streams.reset_index(drop=True)
-    
-    # Fast coordinate extraction
-    start_coords, end_coords = fast_extract_endpoints(basin_streams.geometry)
-    
-    # Calculate lengths
-    print("Calculating lengths...")
-    lengths = basin_streams.geometry.length.values
-    
-    # Build simple connectivity using dictionary
-    print("Building connectivity...")
+def dict_components(start_coords, end_coords):
+    """Pure-Python union-find over a coordinate dictionary"""
     coord_to_segments = defaultdict(list)
     
-    for i in tqdm(range(len(basin_streams)), desc="Building coord map"):
-        start = start_coords[i]
-        end = end_coords[i]
+    for i, (start, end) in enumerate(tqdm(zip(map(tuple, start_coords.tolist()), map(tuple, end_coords.tolist())),
+                                          total=len(start_coords), desc="Building coord map")):
         coord_to_segments[start].append(i)
         coord_to_segments[end].append(i)
     
     # Use Union-Find for connected components
     print("Finding connected components...")
-    parent = list(range(len(basin_streams)))
+    parent = list(range(len(start_coords)))
     
     def find(x):
         root = x
@@ -125,42 +194,297 @@ def process_basin_chunk(basin_streams, starting_river_id):
             for i in range(1, len(segments)):
                 union(segments[0], segments[i])
     
-    # Assign river IDs
+    return np.array([find(i) for i in range(len(start_coords))], dtype=np.int64)
+
+def endpoint_nodes(start_coords, end_coords):
+    """Dense node index for every segment endpoint, shared where keys coincide"""
+    n = len(start_coords)
+    _, node = np.unique(np.vstack([start_coords, end_coords]), axis=0, return_inverse=True)
+    node = node.ravel()
+    return node[:n], node[n:], (node.max() + 1 if len(node) else 0)
+
+def sparse_components(start_coords, end_coords):
+    """Connected components from quantized endpoint keys.
+
+    Shared endpoints are found with a unique over the stacked key array; each
+    segment is then an edge between its start and end node, and the
+    components come from scipy's csgraph.
+    """
+    n = len(start_coords)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    
+    start_node, end_node, n_nodes = endpoint_nodes(start_coords, end_coords)
+    graph = coo_matrix((np.ones(n, dtype=np.int8), (start_node, end_node)), shape=(n_nodes, n_nodes))
+    _, node_labels = connected_components(graph, directed=False)
+    return node_labels[start_node]
+
+def number_components(labels, starting_id):
+    """Number components consecutively by the index of their first segment"""
+    if len(labels) == 0:
+        return np.zeros(0, dtype=int), starting_id
+    
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=int)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return starting_id + rank[inverse.ravel()], starting_id + len(first)
+
+def downstream_links(start_coords, end_coords):
+    """Index of the segment each segment flows into, or -1 at an outlet.
+
+    WhiteboxTools traces stream vectors along the D8 pointer, so every
+    segment runs from its upstream to its downstream vertex and flows into
+    the segment that starts where it ends.
+    """
+    n = len(start_coords)
+    start_node, end_node, n_nodes = endpoint_nodes(start_coords, end_coords)
+    
+    seg_by_start = np.full(n_nodes, -1, dtype=np.int64)
+    starts, first = np.unique(start_node, return_index=True)
+    seg_by_start[starts] = first
+    
+    down = seg_by_start[end_node]
+    down[down == np.arange(n)] = -1
+    return break_cycles(down)
+
+def break_cycles(down):
+    """Cut one link in every loop of the downstream array.
+
+    A segment digitized against the flow direction (e.g. a reversed duplicate)
+    makes two segments flow into each other. Each loop is opened by making the
+    segment reached last, walking from its lowest-index member, an outlet.
+    """
+    n = len(down)
+    has_down = np.flatnonzero(down >= 0)
+    graph = coo_matrix((np.ones(len(has_down), dtype=np.int8), (has_down, down[has_down])), shape=(n, n))
+    _, labels = connected_components(graph, directed=True, connection="strong")
+    sizes = np.bincount(labels, minlength=n)
+    on_cycle = sizes[labels] > 1
+    if not on_cycle.any():
+        return down
+    
+    members = np.flatnonzero(on_cycle)
+    first = np.full(labels.max() + 1, n, dtype=np.int64)
+    np.minimum.at(first, labels[members], members)
+    last = members[down[members] == first[labels[members]]]
+    print(f"Warning: {len(members)} segments against the flow direction form "
+          f"{len(last)} loops; cutting one link in each")
+    
+    down = down.copy()
+    down[last] = -1
+    return down
+
+def flow_distances(lengths, down):
+    """Distance from the farthest source and to the outlet for every segment.
+
+    One topological pass accumulates the longest upstream path length at
+    each segment's downstream end; the reverse pass accumulates the length
+    to the outlet from each segment's upstream end.
+    """
+    order, offsets = topological_levels(down)
+    levels = [order[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)]
+    
+    upstream_max = np.zeros(len(lengths))
+    dist_up = np.zeros(len(lengths))
+    for nodes in levels:
+        dist_up[nodes] = lengths[nodes] + upstream_max[nodes]
+        targets = down[nodes]
+        has_down = targets >= 0
+        np.maximum.at(upstream_max, targets[has_down], dist_up[nodes[has_down]])
+    
+    dist_down = lengths.astype(float)
+    for nodes in reversed(levels):
+        targets = down[nodes]
+        has_down = targets >= 0
+        dist_down[nodes[has_down]] += dist_down[targets[has_down]]
+    
+    return dist_up, dist_down
+
+def process_basin_arrays(start_coords, end_coords, lengths, backend="sparse"):
+    """Connectivity, river numbering and flow distances for one basin's endpoint arrays.
+
+    River IDs are returned zero-based so callers can add a per-basin offset.
+    """
+    # Label connected segments
+    print(f"Building connectivity ({backend} backend)...")
+    if backend == "sparse":
+        labels = sparse_components(start_coords, end_coords)
+    elif backend == "dict":
+        labels = dict_components(start_coords, end_coords)
+    else:
+        raise ValueError(f"Unknown connectivity backend: {backend}")
+    
+    # Assign river IDs in order of each component's first segment
     print("Assigning river IDs...")
-    river_id_map = {}
-    current_id = starting_river_id
-    river_ids = np.zeros(len(basin_streams), dtype=int)
-    
-    for i in range(len(basin_streams)):
-        root = find(i)
-        if root not in river_id_map:
-            river_id_map[root] = current_id
-            current_id += 1
-        river_ids[i] = river_id_map[root]
-    
-    # Simple cumulative distance calculation
+    local_ids, n_rivers = number_components(labels, 0)
+    
+    # Flow-ordered distances along the directed network
     print("Calculating cumulative distances...")
-    cumulative_distances = np.zeros(len(basin_streams))
+    down = downstream_links(start_coords, end_coords)
+    dist_up, dist_down = flow_distances(lengths, down)
     
-    # Group by river ID
-    for river_id in np.unique(river_ids):
-        if river_id == 0:
-            continue
-            
-        river_mask = river_ids == river_id
-        river_indices = np.where(river_mask)[0]
-        
-        if len(river_indices) == 1:
-            cumulative_distances[river_indices[0]] = lengths[river_indices[0]]
-        else:
-            # Simple cumulative sum approach
-            river_lengths = lengths[river_indices]
-            cumulative_sum = np.cumsum(river_lengths)
-            cumulative_distances[river_indices] = cumulative_sum
+    return local_ids, n_rivers, dist_up, dist_down
+
+def limit_worker_memory(max_gb):
+    """Pool initializer capping a worker's address space (Unix only)"""
+    if not max_gb:
+        return
+    try:
+        import resource
+    except ImportError:
+        print("Warning: worker memory cap is not supported on this platform")
+        return
+    limit = int(max_gb * 1024 ** 3)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def process_basin_groups(start_coords, end_coords, lengths, basin_group, backend="sparse",
+                         max_workers=1, max_gb_per_worker=None):
+    """River IDs and flow distances for every basin group in a set of aligned segment arrays.
+
+    Basins run in a process pool unless max_workers is 1; only endpoint keys
+    and lengths are sent to workers. River IDs are offset in basin order once
+    all basins finish, so the numbering matches the serial run.
+    """
+    order = np.argsort(basin_group, kind="stable")
+    groups, counts = np.unique(basin_group[order], return_counts=True)
+    members = np.split(order, np.cumsum(counts)[:-1])
+    args = ([start_coords[idx] for idx in members], [end_coords[idx] for idx in members],
+            [lengths[idx] for idx in members], [backend] * len(members))
+    
+    if max_workers == 1:
+        results = map(process_basin_arrays, *args)
+    else:
+        pool = ProcessPoolExecutor(max_workers=max_workers, initializer=limit_worker_memory,
+                                   initargs=(max_gb_per_worker,))
+        with pool:
+            results = list(tqdm(pool.map(process_basin_arrays, *args), total=len(members), desc="Processing basins"))
+    
+    river_ids = np.zeros(len(lengths), dtype=int)
+    dist_up = np.zeros(len(lengths))
+    dist_down = np.zeros(len(lengths))
+    current_id = 1
+    for basin_id, idx, (local_ids, n_rivers, up, down) in zip(groups, members, results):
+        river_ids[idx] = current_id + local_ids
+        dist_up[idx] = up
+        dist_down[idx] = down
+        current_id += n_rivers
+        print(f"Basin {basin_id} complete: {n_rivers} river networks")
+    
+    return river_ids, dist_up, dist_down, current_id
+
+def process_basins_parallel(basin_groups, backend="sparse", max_workers=None, max_gb_per_worker=None):
+    """Run every basin group of a GeoDataFrame groupby through process_basin_groups"""
+    streams = pd.concat([basin_streams for _, basin_streams in basin_groups], ignore_index=True)
+    start_coords, end_coords = fast_extract_endpoints(streams.geometry)
+    lengths = streams.geometry.length.values
+    
+    river_ids, dist_up, dist_down, current_id = process_basin_groups(
+        start_coords, end_coords, lengths, streams['basin_group'].to_numpy(), backend,
+        max_workers=max_workers, max_gb_per_worker=max_gb_per_worker)
+    
+    streams['River_ID'] = river_ids
+    streams['cumulative_distance'] = dist_up
+    streams['dist_down'] = dist_down
+    streams['length'] = lengths
+    return [streams], current_id
+
+def iter_stream_chunks(path, chunk_size):
+    """Yield the LineString geometries of a vector file in batches of chunk_size features"""
+    with pyogrio.open_arrow(path, columns=[], batch_size=chunk_size, use_pyarrow=True) as (meta, reader):
+        geom_col = meta["geometry_name"] or "wkb_geometry"
+        for batch in reader:
+            geoms = shapely.from_wkb(batch[geom_col])
+            yield geoms[shapely.get_type_id(geoms) == shapely.GeometryType.LINESTRING]
+
+def scan_stream_chunks(path, chunk_size, basin_index):
+    """First streaming pass: compact per-segment arrays built one chunk at a time.
+
+    Only endpoint keys, lengths and basin groups are kept, so segments that
+    meet across a chunk boundary are stitched later through their shared
+    endpoint keys.
+    """
+    parts = defaultdict(list)
+    for geoms in tqdm(iter_stream_chunks(path, chunk_size), desc="Scanning chunks"):
+        start_coords, end_coords = fast_extract_endpoints(geoms)
+        parts['start'].append(start_coords)
+        parts['end'].append(end_coords)
+        parts['length'].append(shapely.length(geoms))
+        parts['basin_group'].append(assign_streams_to_basins(geoms, *basin_index, rule=basin_assignment_rule))
+    
+    if not parts:
+        raise ValueError(f"No LineString features found in {path}")
+    return {key: np.concatenate(arrays) for key, arrays in parts.items()}
+
+def write_stream_chunks(path, chunk_size, output_path, crs, columns):
+    """Second streaming pass: re-read geometries chunk by chunk and append them with their attributes"""
+    offset = 0
+    for part, geoms in enumerate(tqdm(iter_stream_chunks(path, chunk_size), desc="Writing chunks")):
+        n = len(geoms)
+        chunk = gpd.GeoDataFrame({name: values[offset:offset + n] for name, values in columns.items()},
+                                 geometry=geoms, crs=crs)
+        write_table(chunk, output_path, part=part)
+        offset += n
+
+def main_streaming():
+    """Chunked variant of main(): peak memory follows chunk_size, not the file size"""
+    print(f"\n1. Scanning stream segments in chunks of {chunk_size}...")
+    crs = pyogrio.read_info(streams_path)["crs"]
+    basin_index = load_basin_index(basin_paths, crs, basin_index_cache)
+    segments = scan_stream_chunks(streams_path, chunk_size, basin_index)
+    print(f"Scanned {len(segments['length'])} stream segments")
+    
+    no_basin_count = (segments['basin_group'] == 0).sum()
+    if no_basin_count > 0:
+        print(f"Warning: {no_basin_count} streams don't intersect any basin")
+    
+    print("\n2. Processing basins...")
+    river_ids, dist_up, dist_down, _ = process_basin_groups(
+        segments['start'], segments['end'], segments['length'], segments['basin_group'],
+        backend=connectivity_backend, max_workers=n_workers, max_gb_per_worker=max_gb_per_worker)
+    
+    print("\n=== RESULTS SUMMARY ===")
+    print(f"Total stream segments: {len(river_ids)}")
+    print(f"Total river networks: {len(np.unique(river_ids))}")
+    print(f"Max cumulative distance: {dist_up.max():.2f}")
+    
+    print(f"\n3. Saving results to {output_path}")
+    columns = {
+        'River_ID': river_ids,
+        'cumulative_distance': dist_up,
+        'dist_down': dist_down,
+        'length': segments['length'],
+        'basin_group': segments['basin_group'],
+    }
+    write_stream_chunks(streams_path, chunk_size, output_path, crs, columns)
+    
+    print("\n=== COMPLETE ===")
+
+def process_basin_chunk(basin_streams, starting_river_id, backend="sparse"):
+    """Process a single basin efficiently"""
+    
+    if len(basin_streams) == 0:
+        return basin_streams
+    
+    print(f"Processing basin with {len(basin_streams)} segments...")
+    
+    # Reset index
+    basin_streams = basin_streams.reset_index(drop=True)
+    
+    # Fast coordinate extraction
+    start_coords, end_coords = fast_extract_endpoints(basin_streams.geometry)
+    
+    # Calculate lengths
+    print("Calculating lengths...")
+    lengths = basin_streams.geometry.length.values
+    
+    local_ids, n_rivers, dist_up, dist_down = process_basin_arrays(start_coords, end_coords, lengths, backend)
+    river_ids = starting_river_id + local_ids
+    current_id = starting_river_id + n_rivers
     
     # Add results to dataframe
     basin_streams['River_ID'] = river_ids
-    basin_streams['cumulative_distance'] = cumulative_distances
+    basin_streams['cumulative_distance'] = dist_up  # distance from the farthest source
+    basin_streams['dist_down'] = dist_down  # distance to the outlet
     basin_streams['length'] = lengths
     
     return basin_streams, current_id
@@ -168,6 +492,10 @@ def process_basin_chunk(basin_streams, starting_river_id):
 def main():
     print("=== Fast Basin-Based Stream Network Analysis ===")
     
+    if chunk_size:
+        main_streaming()
+        return
+    
     # Load streams
     print("\n1. Loading stream segments...")
     streams_gdf = gpd.read_file(streams_path)
@@ -177,22 +505,19 @@ def main():
     
     # Load basins
     print("\n2. Loading basin data...")
-    basins_gdf = load_basin_data(basin_paths)
+    basin_geoms, basin_group_ids, basin_tree = load_basin_index(basin_paths, streams_gdf.crs, basin_index_cache)
     
     # Assign streams to basins
     print("\n3. Assigning streams to basins...")
-    if streams_gdf.crs != basins_gdf.crs:
-        print(f"Reprojecting basins from {basins_gdf.crs} to {streams_gdf.crs}")
-        basins_gdf = basins_gdf.to_crs(streams_gdf.crs)
-    
-    print("Performing spatial join...")
-    streams_with_basins = gpd.sjoin(streams_gdf, basins_gdf, how='left', predicate='intersects')
+    print(f"Assigning primary basins ({basin_assignment_rule} rule)...")
+    streams_with_basins = streams_gdf
+    streams_with_basins['basin_group'] = assign_streams_to_basins(
+        streams_gdf.geometry, basin_geoms, basin_group_ids, basin_tree, rule=basin_assignment_rule)
     
     # Handle streams without basins
-    no_basin_count = streams_with_basins['basin_group'].isna().sum()
+    no_basin_count = (streams_with_basins['basin_group'] == 0).sum()
     if no_basin_count > 0:
         print(f"Warning: {no_basin_count} streams don't intersect any basin")
-        streams_with_basins['basin_group'] = streams_with_basins['basin_group'].fillna(0)
     
     # Basin summary
     print(f"\nBasin assignment summary:")
@@ -207,23 +532,29 @@ def main():
     
     basin_groups = streams_with_basins.groupby('basin_group')
     
-    for basin_id, basin_streams in basin_groups:
-        print(f"\n--- Processing Basin {basin_id} ---")
-        
-        if len(basin_streams) == 0:
-            continue
-        
-        # Process this basin
-        basin_result, next_river_id = process_basin_chunk(basin_streams.copy(), current_river_id)
-        current_river_id = next_river_id
-        
-        all_results.append(basin_result)
-        
-        print(f"Basin {basin_id} complete: {basin_result['River_ID'].nunique()} river networks")
-        
-        # Memory cleanup
-        del basin_result
-        gc.collect()
+    if n_workers != 1:
+        all_results, current_river_id = process_basins_parallel(
+            basin_groups, backend=connectivity_backend, max_workers=n_workers,
+            max_gb_per_worker=max_gb_per_worker)
+    else:
+        for basin_id, basin_streams in basin_groups:
+            print(f"\n--- Processing Basin {basin_id} ---")
+            
+            if len(basin_streams) == 0:
+                continue
+            
+            # Process this basin
+            basin_result, next_river_id = process_basin_chunk(basin_streams.copy(), current_river_id,
+                                                               backend=connectivity_backend)
+            current_river_id = next_river_id
+            
+            all_results.append(basin_result)
+            
+            print(f"Basin {basin_id} complete: {basin_result['River_ID'].nunique()} river networks")
+            
+            # Memory cleanup
+            del basin_result
+            gc.collect()
     
     # Combine results
     print("\n5. Combining results...")
@@ -245,9 +576,9 @@ def main():
     
     # Save results
     print(f"\n6. Saving results to {output_path}")
-    columns_to_keep = ['geometry', 'River_ID', 'cumulative_distance', 'length', 'basin_group']
+    columns_to_keep = ['geometry', 'River_ID', 'cumulative_distance', 'dist_down', 'length', 'basin_group']
     available_columns = [col for col in columns_to_keep if col in final_streams.columns]
-    final_streams[available_columns].to_file(output_path)
+    write_table(final_streams[available_columns], output_path)
     
     # Sample results
     print("\nSample results:")
@@ -1,72 +1,240 @@
 import pandas as pd
-import networkx as nx
+import numpy as np
 from tqdm import tqdm
+import json
 import os
+import shutil
+import zlib
 
-# Load river CSV file
-df = pd.read_csv("Rivers.csv")
-assert 'HYRIV_ID' in df.columns, "Missing HYRIV_ID"
-assert 'NEXT_DOWN' in df.columns, "Missing NEXT_DOWN"
-
-# Build directed river network graph
-G = nx.DiGraph()
-edges = [(row['HYRIV_ID'], row['NEXT_DOWN']) for _, row in df.iterrows()
-         if row['NEXT_DOWN'] != 0 and not pd.isnull(row['NEXT_DOWN'])]
-G.add_edges_from(edges)
-
-# Identify all source nodes
-all_sources = [n for n in G.nodes if G.in_degree(n) == 0]
-
-# Check for existing progress
-processed_ids = set()
-if os.path.exists("temp_RiverID_partial.csv"):
-    processed_df = pd.read_csv("temp_RiverID_partial.csv")
-    processed_ids = set(processed_df['HYRIV_ID'])
-
-# Only process sources not already handled
-sources_to_process = [s for s in all_sources if s not in processed_ids]
-
-# Initialize output list
-river_id_map = []
-chunk_size = 200
-
-# Process in chunks using BFS (faster and memory-safe)
-for start in tqdm(range(0, len(sources_to_process), chunk_size), desc="Processing in chunks"):
-    end = min(start + chunk_size, len(sources_to_process))
-    chunk = sources_to_process[start:end]
-
-    for i, source in enumerate(chunk, start=start):
-        river_id = f"River_{i+1}"
-        visited = set()
-        queue = [(source, 0)]
-
-        while queue:
-            node, order = queue.pop(0)
-            if node not in visited:
-                visited.add(node)
-                river_id_map.append({
-                    'HYRIV_ID': node,
-                    'River_ID': river_id,
-                    'Order': order
-                })
-                for neighbor in G.successors(node):
-                    queue.append((neighbor, order + 1))
-
-    # Save to file incrementally
-    partial_df = pd.DataFrame(river_id_map)
-    partial_df.drop_duplicates(subset=['HYRIV_ID'], inplace=True)
-    if not os.path.exists("temp_RiverID_partial.csv"):
-        partial_df.to_csv("temp_RiverID_partial.csv", index=False, mode='w')
+from geo_io import read_table, write_table
+
+# Paths
+rivers_path = "Rivers.csv"
+output_path = "Rivers_with_RiverID.csv"  # .parquet/.feather also work
+checkpoint_dir = "temp_RiverID_checkpoint"
+checkpoint_every = 50  # generations between progress flushes
+
+# "first_source" reproduces the original BFS labelling: every reach takes the
+# River_ID of the first headwater (in file order) that drains through it.
+# "longest_path" follows the longest headwater path instead (hydrological main stem).
+label_mode = "first_source"
+
+def build_dense_network(df):
+    """Map HYRIV_ID/NEXT_DOWN onto dense integer indices"""
+    reach_ids = df['HYRIV_ID'].to_numpy(dtype=np.int64)
+    next_down = pd.to_numeric(df['NEXT_DOWN'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+    has_down = next_down != 0
+
+    # Downstream targets that are not in the table still become nodes,
+    # exactly as they did in the networkx graph
+    node_ids = np.unique(np.concatenate([reach_ids, next_down[has_down]]))
+    row_node = np.searchsorted(node_ids, reach_ids)
+
+    down = np.full(len(node_ids), -1, dtype=np.int64)
+    down[row_node[has_down]] = np.searchsorted(node_ids, next_down[has_down])
+
+    # Reaches with no downstream link and nothing flowing in never entered the graph
+    in_graph = np.zeros(len(node_ids), dtype=bool)
+    in_graph[row_node[has_down]] = True
+    in_graph[down[down >= 0]] = True
+
+    return node_ids, row_node, down, in_graph
+
+def topological_levels(down):
+    """Kahn's algorithm over the downstream array, one vectorized step per generation.
+
+    Returns the nodes in topological order and the offsets of each generation,
+    so that every node comes after all reaches draining into it.
+    """
+    n = len(down)
+    valid = down >= 0
+    indeg = np.bincount(down[valid], minlength=n)
+
+    frontier = np.flatnonzero(indeg == 0)
+    levels = []
+    processed = 0
+    while len(frontier):
+        levels.append(frontier)
+        processed += len(frontier)
+        targets = down[frontier]
+        targets = targets[targets >= 0]
+        np.subtract.at(indeg, targets, 1)
+        frontier = np.unique(targets[indeg[targets] == 0])
+
+    if processed != n:
+        raise ValueError(f"River network contains a cycle ({n - processed} reaches unreachable)")
+
+    order = np.concatenate(levels) if levels else np.empty(0, dtype=np.int64)
+    offsets = np.cumsum([0] + [len(level) for level in levels])
+    return order, offsets
+
+def source_keys(down, in_graph, row_node, mode):
+    """Encode each headwater's rank and path length into a single sortable int64 key"""
+    n = len(down)
+    indeg = np.bincount(down[down >= 0], minlength=n)
+
+    is_source = indeg == 0
+    if mode == "first_source":
+        is_source &= in_graph
+    # Headwaters are ranked by file order, as the graph's node order was
+    source_nodes = row_node[is_source[row_node]]
+    _, first = np.unique(source_nodes, return_index=True)
+    source_nodes = source_nodes[np.sort(first)]
+
+    key = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    n_sources = max(len(source_nodes), 1)
+    if mode == "first_source":
+        # key = rank * n + hops: the lowest-ranked source wins
+        key[source_nodes] = np.arange(len(source_nodes), dtype=np.int64) * n
+    elif mode == "longest_path":
+        # key = (n - hops) * n_sources + rank: the longest path wins, ties go to the lower rank
+        key[source_nodes] = n * n_sources + np.arange(len(source_nodes), dtype=np.int64)
+    else:
+        raise ValueError(f"Unknown label mode: {mode}")
+    return key, n_sources
+
+def propagate_keys(key, down, order, offsets, mode, n_sources, start_level=0, on_level=None):
+    """Push source keys downstream in a single pass over the topological generations"""
+    step = 1 if mode == "first_source" else -n_sources
+    unset = np.iinfo(np.int64).max
+
+    for level in tqdm(range(start_level, len(offsets) - 1), desc="Labelling generations"):
+        nodes = order[offsets[level]:offsets[level + 1]]
+        targets = down[nodes]
+        keep = (targets >= 0) & (key[nodes] != unset)
+        np.minimum.at(key, targets[keep], key[nodes[keep]] + step)
+        if on_level is not None:
+            on_level(level)
+    return key
+
+def decode_keys(key, n, n_sources, mode):
+    """Turn propagated keys back into River_ID labels and hop orders"""
+    labelled = key != np.iinfo(np.int64).max
+    if mode == "first_source":
+        rank = key // n
+        hops = key % n
+    else:
+        rank = key % n_sources
+        hops = n - key // n_sources
+    return rank, hops, labelled
+
+def label_rivers(df, mode="first_source", checkpoint_dir=None):
+    """Compute River_ID and Order for every reach in one linear pass"""
+    node_ids, row_node, down, in_graph = build_dense_network(df)
+
+    if checkpoint_dir is None:
+        order, offsets = topological_levels(down)
+        key, n_sources = source_keys(down, in_graph, row_node, mode)
+        key = propagate_keys(key, down, order, offsets, mode, n_sources)
+        return assign_labels(df, key[row_node], len(node_ids), n_sources, mode)
+
+    store = CheckpointStore(checkpoint_dir, down, row_node, mode)
+    if not store.resume():
+        order, offsets = topological_levels(down)
+        key, n_sources = source_keys(down, in_graph, row_node, mode)
+        store.create(key, order, offsets, n_sources)
     else:
-        partial_df.to_csv("temp_RiverID_partial.csv", index=False, mode='a', header=False)
-    river_id_map.clear()  # reset for next chunk
+        print(f"Resuming from generation {store.next_level} of {len(store.offsets) - 1}")
+
+    propagate_keys(store.key, down, store.order, store.offsets, mode, store.n_sources,
+                   start_level=store.next_level, on_level=store.on_level)
+    store.key.flush()
+    return assign_labels(df, store.key[row_node], len(node_ids), store.n_sources, mode)
+
+class CheckpointStore:
+    """Restartable labelling state kept as memory-mapped arrays keyed by dense reach index.
+
+    key.npy holds the propagated key of every node, order.npy/offsets.npy the
+    cached topological generations, and progress.json the next generation to
+    push. Pushing a generation is a min-update, so replaying the generations
+    after the last flushed checkpoint is harmless and never duplicates rows.
+    """
+
+    def __init__(self, path, down, row_node, mode):
+        self.path = path
+        self.mode = mode
+        self.n = len(down)
+        # Source keys are ranked by row order, so a reordered table must not resume
+        self.fingerprint = zlib.crc32(row_node.tobytes(), zlib.crc32(down.tobytes()))
+        self.next_level = 0
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def resume(self):
+        """Attach to an existing checkpoint if it was built from the same network"""
+        try:
+            with open(self._file("progress.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (meta.get("n") != self.n or meta.get("mode") != self.mode
+                or meta.get("fingerprint") != self.fingerprint):
+            print("Checkpoint does not match the current network, starting over")
+            return False
+
+        self.key = np.load(self._file("key.npy"), mmap_mode="r+")
+        self.order = np.load(self._file("order.npy"), mmap_mode="r")
+        self.offsets = np.load(self._file("offsets.npy"))
+        self.n_sources = meta["n_sources"]
+        self.next_level = meta["next_level"]
+        return True
+
+    def create(self, key, order, offsets, n_sources):
+        """Start a fresh checkpoint from the initial source keys"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+        np.save(self._file("order.npy"), order)
+        np.save(self._file("offsets.npy"), offsets)
+        self.key = np.lib.format.open_memmap(self._file("key.npy"), mode="w+", dtype=np.int64, shape=(self.n,))
+        self.key[:] = key
+        self.order = order
+        self.offsets = offsets
+        self.n_sources = n_sources
+        self.next_level = 0
+        self.save()
+
+    def save(self):
+        """Flush the key array, then atomically record the next generation to push"""
+        self.key.flush()
+        meta = {
+            "n": self.n,
+            "mode": self.mode,
+            "fingerprint": self.fingerprint,
+            "n_sources": self.n_sources,
+            "next_level": self.next_level,
+        }
+        tmp = self._file("progress.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._file("progress.json"))
+
+    def on_level(self, level):
+        self.next_level = level + 1
+        if self.next_level % checkpoint_every == 0:
+            self.save()
+
+def assign_labels(df, row_keys, n, n_sources, mode):
+    """Attach River_ID/Order columns decoded from per-row keys"""
+    rank, hops, labelled = decode_keys(row_keys, n, n_sources, mode)
+    out = df.copy()
+    out['River_ID'] = pd.Series(rank + 1, index=out.index).astype(str).radd("River_").where(labelled)
+    out['Order'] = pd.Series(hops, index=out.index).where(labelled)
+    return out
+
+def main():
+    # Load river CSV file
+    df = read_table(rivers_path)
+    assert 'HYRIV_ID' in df.columns, "Missing HYRIV_ID"
+    assert 'NEXT_DOWN' in df.columns, "Missing NEXT_DOWN"
+
+    df = label_rivers(df, mode=label_mode, checkpoint_dir=checkpoint_dir)
+    write_table(df, output_path)
 
-# Merge full result
-final_df = pd.read_csv("temp_RiverID_partial.csv")
-df = df.merge(final_df, on='HYRIV_ID', how='left')
-df.to_csv("Rivers_with_RiverID.csv", index=False)
+    # Clean up checkpoint
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
 
-# Clean up temp file
-os.remove("temp_RiverID_partial.csv")
+    print(f"River ID assignment complete. Output saved to '{output_path}'")
 
-print("River ID assignment complete. Output saved to 'Rivers_with_RiverID.csv'")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -2,59 +2,96 @@ import geopandas as gpd
 import pandas as pd
 import numpy as np
 import os
+import sys
 
-# Load shapefile
-shp_path = "rivers_overlap_basins/rivers_overlap_basin_1_interpolated_points_50_elevation_vu.shp"
-gdf = gpd.read_file(shp_path)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geo_io import read_table
+from river_distance import cumulative_distance, group_starts
 
-# Check columns
+# Point files to summarise, keyed by basin name; each gets <basin>_summary.csv
+basin_point_paths = {
+    "basin_1": "rivers_overlap_basins/rivers_overlap_basin_1_interpolated_points_50_elevation_vu.shp",
+    # "basin_2": "rivers_overlap_basins/rivers_overlap_basin_2_interpolated_points_50_elevation_vu.shp",
+    # "basin_3": "rivers_overlap_basins/rivers_overlap_basin_3_interpolated_points_50_elevation_vu.shp",
+    # "basin_4": "rivers_overlap_basins/rivers_overlap_basin_4_interpolated_points_50_elevation_vu.shp",
+}
+output_dir = "rivers_overlap_basins"
 required_cols = ["River_ID", "Order", "Elevation1", "Vu1"]
-for col in required_cols:
-    if col not in gdf.columns:
-        raise ValueError(f"Missing required column: {col}")
-
-# Compute cumulative distance per river
-def compute_cumulative_distance(coords):
-    dists = [0]
-    for i in range(1, len(coords)):
-        dist = coords[i].distance(coords[i - 1])
-        dists.append(dists[-1] + dist)
-    return dists
-
-summary_rows = []
-
-for river_id, group in gdf.groupby("River_ID"):
-    if len(group) < 20:
-        continue
-
-    group_sorted = group.sort_values("Order").reset_index(drop=True)
-    coords = group_sorted.geometry
-    distances = compute_cumulative_distance(coords)
-    group_sorted["Distance_m"] = distances
-
-    river_length_km = distances[-1] / 1000 if distances else 0
-    elev = group_sorted["Elevation1"]
-    vu = group_sorted["Vu1"]
-
-    summary_rows.append({
-        "River_ID": river_id,
-        "Num_Points": len(group_sorted),
-        "River_Length_km": round(river_length_km, 2),
-        "Elevation_Min": elev.min(),
-        "Elevation_Max": elev.max(),
-        "Elevation_Change": elev.max() - elev.min(),
-        "Elevation_Mean": elev.mean(),
-        "VU_Min": vu.min(),
-        "VU_Max": vu.max(),
-        "VU_Mean": vu.mean(),
-        "VU_Std": vu.std(),
-        "VU_Range": vu.max() - vu.min(),
-        "VU_Anomalies": ((vu < -2) | (vu > 2)).sum()  # Count outliers
+min_points = 20
+anomaly_threshold = 2  # |VU| beyond this counts as an outlier
+
+def load_points(paths):
+    """Read every basin's points into one frame tagged with a basin code"""
+    frames = []
+    for code, (basin, path) in enumerate(paths.items()):
+        gdf = read_table(path, columns=required_cols + ["geometry"])
+
+        # Check columns
+        for col in required_cols:
+            if col not in gdf.columns:
+                raise ValueError(f"Missing required column in {basin}: {col}")
+        frame = pd.DataFrame({col: gdf[col].to_numpy() for col in required_cols})
+        frame["x"] = gdf.geometry.x.to_numpy()
+        frame["y"] = gdf.geometry.y.to_numpy()
+        frame["Basin"] = code
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+def segment_stats(values, first, counts):
+    """NaN-skipping min/max/mean/std (ddof=1) over contiguous blocks, like the pandas methods"""
+    valid = ~np.isnan(values)
+    n_valid = np.add.reduceat(valid.astype(np.int64), first)
+    total = np.add.reduceat(np.where(valid, values, 0.0), first)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n_valid
+        deviation = np.where(valid, values - np.repeat(mean, counts), 0.0)
+        std = np.sqrt(np.add.reduceat(deviation ** 2, first) / (n_valid - 1))
+    std[n_valid < 2] = np.nan
+    return np.fmin.reduceat(values, first), np.fmax.reduceat(values, first), mean, std
+
+def summarise(points):
+    """One row of profile statistics per (basin, river), from a single global sort"""
+    points = points.sort_values(["Basin", "River_ID", "Order"], kind="stable").reset_index(drop=True)
+    river_key = points["Basin"].astype(str) + "|" + points["River_ID"].astype(str)
+    starts = group_starts(river_key.to_numpy())
+    first = np.flatnonzero(starts)
+    counts = np.diff(np.append(first, len(points)))
+    last = first + counts - 1
+
+    # Compute cumulative distance for every river at once
+    distance = cumulative_distance(points["x"], points["y"], np.cumsum(starts))
+    elev_min, elev_max, elev_mean, _ = segment_stats(points["Elevation1"].to_numpy(dtype=float), first, counts)
+    vu = points["Vu1"].to_numpy(dtype=float)
+    vu_min, vu_max, vu_mean, vu_std = segment_stats(vu, first, counts)
+    anomalies = np.add.reduceat(((vu < -anomaly_threshold) | (vu > anomaly_threshold)).astype(np.int64), first)
+
+    summary = pd.DataFrame({
+        "Basin": points["Basin"].to_numpy()[first],
+        "River_ID": points["River_ID"].to_numpy()[first],
+        "Num_Points": counts,
+        "River_Length_km": np.round(distance[last] / 1000, 2),
+        "Elevation_Min": elev_min,
+        "Elevation_Max": elev_max,
+        "Elevation_Change": elev_max - elev_min,
+        "Elevation_Mean": elev_mean,
+        "VU_Min": vu_min,
+        "VU_Max": vu_max,
+        "VU_Mean": vu_mean,
+        "VU_Std": vu_std,
+        "VU_Range": vu_max - vu_min,
+        "VU_Anomalies": anomalies,  # Count outliers
     })
+    return summary[summary["Num_Points"] >= min_points].reset_index(drop=True)
+
+def main():
+    summary = summarise(load_points(basin_point_paths))
 
-# Convert to DataFrame and export
-summary_df = pd.DataFrame(summary_rows)
-output_path = "rivers_overlap_basins/basin_1_summary.csv"
-summary_df.to_csv(output_path, index=False)
+    # Split back into one table per basin and export
+    for code, basin in enumerate(basin_point_paths):
+        summary_df = summary[summary["Basin"] == code].drop(columns="Basin")
+        output_path = os.path.join(output_dir, f"{basin}_summary.csv")
+        summary_df.to_csv(output_path, index=False)
+        print(f"✅ Summary table saved to {output_path}")
 
-print(f"✅ Summary table saved to {output_path}")
+if __name__ == "__main__":
+    main()
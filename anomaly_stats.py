@@ -0,0 +1,128 @@
+import glob
+import numpy as np
+import pandas as pd
+
+from geo_io import read_table, write_table
+
+# Mergeable mean/variance for VU anomaly z-scores. Moments are accumulated per
+# key (one key for global statistics, or basin / River_ID) from any number of
+# chunks with Chan's parallel update, and can be saved so that new points are
+# scored against the stored population without rescanning it.
+points_pattern = "rivers_overlap_basins/rivers_overlap_basin_*_interpolated_points_50_elevation_vu.shp"
+moments_path = "rivers_overlap_basins/vu_moments.csv"
+value_column = "Vu1"
+GLOBAL_KEY = "all"
+
+def key_strings(keys):
+    """Keys as strings, the form they take in the table and in saved files"""
+    return np.asarray(keys).astype(str)
+
+class MomentTable:
+    """Count, mean and sum of squared deviations (M2) for every key.
+
+    Keys are stored as strings so a table loaded from disk matches the
+    integer or string keys it was built from.
+    """
+
+    def __init__(self, moments=None):
+        self.moments = moments if moments is not None else \
+            pd.DataFrame({"count": [], "mean": [], "m2": []}).astype({"count": np.int64})
+
+    @staticmethod
+    def chunk_moments(keys, values):
+        """Moments of one chunk in a single grouped pass (NaN values are skipped)"""
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        codes, uniques = pd.factorize(key_strings(keys)[valid])
+        values = values[valid]
+
+        count = np.bincount(codes, minlength=len(uniques))
+        mean = np.bincount(codes, weights=values, minlength=len(uniques)) / np.maximum(count, 1)
+        m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=len(uniques))
+        return pd.DataFrame({"count": count, "mean": mean, "m2": m2}, index=pd.Index(uniques, name="key"))
+
+    def merge(self, other):
+        """Combine with another set of moments (Chan et al. pairwise update)"""
+        other = other.moments if isinstance(other, MomentTable) else other
+        keys = self.moments.index.union(other.index)
+        a = self.moments.reindex(keys)
+        b = other.reindex(keys)
+        n_a = a["count"].fillna(0).to_numpy()
+        n_b = b["count"].fillna(0).to_numpy()
+        mean_a = a["mean"].fillna(0).to_numpy()
+        mean_b = b["mean"].fillna(0).to_numpy()
+
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(n > 0, mean_a + delta * n_b / n, np.nan)
+            m2 = a["m2"].fillna(0).to_numpy() + b["m2"].fillna(0).to_numpy() + delta ** 2 * n_a * n_b / n
+        self.moments = pd.DataFrame({"count": n.astype(np.int64), "mean": mean, "m2": np.nan_to_num(m2)},
+                                    index=pd.Index(keys, name="key"))
+        return self
+
+    def update(self, keys, values):
+        """Fold a chunk of (key, value) observations into the table"""
+        return self.merge(self.chunk_moments(keys, values))
+
+    def std(self, ddof=1):
+        count = self.moments["count"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(self.moments["m2"] / (count - ddof)).where(count > ddof)
+
+    def zscore(self, keys, values, ddof=1):
+        """Z-scores against the stored moments (NaN for keys never seen)"""
+        idx = self.moments.index.get_indexer(key_strings(keys))
+        known = idx >= 0
+        mean = np.where(known, self.moments["mean"].to_numpy()[idx], np.nan)
+        std = np.where(known, self.std(ddof).to_numpy()[idx], np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (np.asarray(values, dtype=float) - mean) / std
+
+    def save(self, path):
+        write_table(self.moments.reset_index(), path)
+
+    @classmethod
+    def load(cls, path, level=None):
+        """Moments saved by save(), or one level ("global", "basin", "river") of main()'s table"""
+        table = read_table(path)
+        if level is not None:
+            table = table[table["level"] == level].drop(columns="level")
+        table["key"] = table["key"].astype(str)
+        return cls(table.set_index("key"))
+
+def zscores(df, column=value_column, by=None):
+    """Z-scores of one column over the whole frame, or within each group of `by`"""
+    keys = np.full(len(df), GLOBAL_KEY, dtype=object) if by is None else df[by].to_numpy()
+    return MomentTable().update(keys, df[column]).zscore(keys, df[column])
+
+def accumulate(chunks, column=value_column, by=None):
+    """Moments over an iterable of DataFrame chunks, one pass, constant memory per key"""
+    table = MomentTable()
+    for chunk in chunks:
+        keys = np.full(len(chunk), GLOBAL_KEY, dtype=object) if by is None else chunk[by].to_numpy()
+        table.update(keys, chunk[column])
+    return table
+
+def main():
+    paths = sorted(glob.glob(points_pattern))
+    if not paths:
+        raise FileNotFoundError(f"No point files match {points_pattern}")
+
+    # One read per file feeds the global, per-basin and per-river accumulators
+    levels = {"global": MomentTable(), "basin": MomentTable(), "river": MomentTable()}
+    for path in paths:
+        basin = path.split("rivers_overlap_basin_")[-1].split("_")[0]
+        chunk = read_table(path, columns=["River_ID", value_column])
+        values = chunk[value_column]
+        levels["global"].update(np.full(len(chunk), GLOBAL_KEY, dtype=object), values)
+        levels["basin"].update(np.full(len(chunk), basin, dtype=object), values)
+        levels["river"].update((basin + "|" + chunk["River_ID"].astype(str)).to_numpy(), values)
+        print(f"Accumulated {len(chunk)} points from {path}")
+
+    stored = pd.concat({level: table.moments for level, table in levels.items()}, names=["level", "key"])
+    write_table(stored.reset_index(), moments_path)
+    print(f"✅ VU moments saved to: {moments_path}")
+
+if __name__ == "__main__":
+    main()
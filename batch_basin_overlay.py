@@ -0,0 +1,91 @@
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import geopandas as gpd
+import matplotlib
+import numpy as np
+import pandas as pd
+import shapely
+
+import fault_overlay as fo
+from plot_vu_anomaly import plot_zscore_map
+from plot_vu_anomaly_v2 import plot_main_river_anomalies
+
+# Runs the fault overlay and VU anomaly figures for every sub-basin. The fault
+# layer is read, classified and indexed once; each worker gets only the faults
+# near its basin and reads its own point set.
+basin_pattern = "hybas4_selected_subbasin_*.shp"
+points_template = "rivers_overlap_basins/rivers_overlap_basin_{n}_interpolated_points_50_elevation_vu.shp"
+figures_template = "figures/basin_{n}"
+zscore_map_template = "rivers_overlap_basins/basin_{n}_vu_zscore_map.png"
+anomaly_plots_template = "rivers_overlap_basins/basin_{n}_plots/basin_{n}_vu_zscore_maps"
+consolidated_path = "figures/fault_proximity_anomalies_all_basins.csv"
+n_workers = 4
+
+def find_basins(pattern=basin_pattern):
+    """(basin number, basin path, points path) for every basin with a point set, by number"""
+    basins = []
+    for path in glob.glob(pattern):
+        match = re.search(r"_(\d+)\.shp$", path)
+        if not match:
+            continue
+        n = int(match.group(1))
+        points_path = points_template.format(n=n)
+        if not os.path.exists(points_path):
+            print(f"⚠️ Skipping basin {n}: no point set at {points_path}")
+            continue
+        basins.append((n, path, points_path))
+    return sorted(basins)
+
+def init_worker():
+    matplotlib.use("Agg")
+
+def process_basin(n, basin, points_path, faults):
+    """Overlay, proximity table and anomaly figures for one basin"""
+    label = f"Basin {n}"
+    points = fo.load_points(points_path, basin.crs)
+    summary = fo.fault_overlay(basin, points, faults, figures_template.format(n=n), label)
+    plot_zscore_map(points, basin, zscore_map_template.format(n=n), label, show=False)
+    plot_main_river_anomalies(points, basin, anomaly_plots_template.format(n=n), label)
+
+    summary.insert(0, "Basin", n)
+    return summary
+
+def run_batch(workers=None):
+    basins = find_basins()
+    if not basins:
+        raise FileNotFoundError(f"No basins with point sets match {basin_pattern}")
+    print(f"\n=== Fault Overlay Batch: {len(basins)} basins ===")
+
+    # Faults and their index are built once for all basins
+    polygons = {n: gpd.read_file(path).explode(index_parts=False) for n, path, _ in basins}
+    faults = fo.load_faults(fo.faults_path, polygons[basins[0][0]].crs)
+    tree = shapely.STRtree(faults.geometry.values)
+
+    tasks = []
+    for n, _, points_path in basins:
+        basin = polygons[n]
+        extent = shapely.union_all(basin.to_crs(faults.crs).geometry.values)
+        nearby = faults.iloc[np.sort(tree.query(extent, predicate="intersects"))].to_crs(basin.crs)
+        tasks.append((n, basin, points_path, nearby))
+
+    workers = workers or n_workers
+    if workers == 1:
+        init_worker()
+        summaries = [process_basin(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            summaries = list(pool.map(process_basin, *zip(*tasks)))
+
+    consolidated = pd.concat(summaries, ignore_index=True)
+    os.makedirs(os.path.dirname(consolidated_path), exist_ok=True)
+    consolidated.to_csv(consolidated_path, index=False)
+    print(f"✅ Consolidated proximity table saved to: {consolidated_path}")
+    return consolidated
+
+def main():
+    run_batch()
+
+if __name__ == "__main__":
+    main()
@@ -3,67 +3,34 @@ import matplotlib.pyplot as plt
 import os
 import pandas as pd
 import numpy as np
+import shapely
 from shapely.geometry import LineString, MultiLineString
 
+from anomaly_stats import zscores
+from geo_io import read_table, write_table
+
 # File paths
 faults_path = "faults/faults_singlepart.shp"
 basin_path = "hybas4_selected_subbasin_1.shp"
 points_path = "rivers_overlap_basins/rivers_overlap_basin_1_interpolated_points_50_elevation_vu.shp"
-
-# Load datasets
-faults = gpd.read_file(faults_path)
-basin = gpd.read_file(basin_path).explode(index_parts=False)
-points = gpd.read_file(points_path)
-
-# Ensure consistent CRS
-faults = faults.to_crs(basin.crs)
-points = points.to_crs(basin.crs)
-
-# Clip faults to basin extent
-faults_clipped = gpd.clip(faults, basin)
-
-# Classify faults (basic parser from attribute)
-def classify_fault(text):
-    text = str(text).lower()
-    if "reverse" in text:
-        return "Reverse"
-    elif "normal" in text:
-        return "Normal"
-    elif "left" in text:
-        return "Left Lateral"
-    elif "right" in text:
-        return "Right Lateral"
-    elif "strike" in text:
-        return "Strike-Slip"
-    else:
-        return "Other"
-
-# Identify proper attribute field
-possible_fields = ["Fea_En", "NAME", "Type", "description"]
-fault_field = next((f for f in possible_fields if f in faults_clipped.columns), None)
-if not fault_field:
-    raise ValueError("❌ Could not find a suitable fault description field.")
-
-# Apply classification
-faults_clipped["Fault_Type"] = faults_clipped[fault_field].apply(classify_fault)
-
-# Ensure Vu_zscore exists
-if "Vu_zscore" not in points.columns:
-    points["Vu_zscore"] = (points["Vu1"] - points["Vu1"].mean()) / points["Vu1"].std()
-
-# Identify main river
-main_river_id = points.groupby("River_ID").size().idxmax()
-main_river = points[points["River_ID"] == main_river_id].sort_values("Order").reset_index(drop=True)
-
-# Detect anomalies
-main_river["Anomaly"] = np.where(main_river["Vu_zscore"].abs() > 2, "Anomaly", "Normal")
-critical_points = main_river[main_river["Anomaly"] == "Anomaly"]
+point_columns = ["River_ID", "Order", "Elevation1", "Vu1", "Vu_zscore", "geometry"]
 
 # Output directory
 output_dir = "figures/basin_1"
-os.makedirs(output_dir, exist_ok=True)
-output_path = os.path.join(output_dir, "faults_vu_overlay.png")
-summary_table_path = os.path.join(output_dir, "fault_proximity_anomalies.csv")
+
+# Classify faults from their description attribute. Rules are checked in order
+# and the first case-insensitive substring match wins; a CSV with "pattern" and
+# "fault_type" columns at fault_rules_path replaces the defaults, so other
+# fault vocabularies need no code changes.
+fault_rules = [
+    ("reverse", "Reverse"),
+    ("normal", "Normal"),
+    ("left", "Left Lateral"),
+    ("right", "Right Lateral"),
+    ("strike", "Strike-Slip"),
+]
+fault_rules_path = "faults/fault_type_rules.csv"
+default_fault_type = "Other"
 
 # Define fault colors
 fault_colors = {
@@ -75,49 +42,161 @@ fault_colors = {
     "Other": "grey"
 }
 
-# Create buffers and calculate anomaly counts
+# Nearest-fault distances are computed once out to max_proximity_dist, so the
+# anomaly counts for any buffer distance up to it are just a threshold
 buffer_dist = 5000  # 5 km
-records = []
-for ftype, group in faults_clipped.groupby("Fault_Type"):
-    buffered = group.buffer(buffer_dist)
-    merged = buffered.unary_union
-    points_within = points[points.geometry.within(merged)]
-    anomalies = points_within[points_within["Vu_zscore"].abs() > 2]
-    records.append({
-        "Fault Type": ftype,
-        "Anomalies Near Fault": len(anomalies),
-        "Total Points Near Fault": len(points_within),
-        "Anomaly Density (per 100 pts)": (len(anomalies) / max(len(points_within), 1)) * 100
-    })
-
-summary_df = pd.DataFrame(records)
-summary_df.to_csv(summary_table_path, index=False)
-print(f"✅ Proximity anomaly summary saved to: {summary_table_path}")
-
-# Plot
-fig, ax = plt.subplots(figsize=(12, 8))
-basin.boundary.plot(ax=ax, color="black", linewidth=1)
-points.plot(ax=ax, column="Vu_zscore", cmap="coolwarm", markersize=3, legend=True, vmin=-3, vmax=3)
-
-# Faults by type
-for ftype, color in fault_colors.items():
-    subset = faults_clipped[faults_clipped["Fault_Type"] == ftype]
-    if not subset.empty:
-        subset.plot(ax=ax, linewidth=1.5, color=color, label=ftype)
-
-# Dissolve main river and plot
-main_river_line = main_river.unary_union
-if isinstance(main_river_line, (LineString, MultiLineString)):
-    gpd.GeoSeries([main_river_line], crs=points.crs).plot(ax=ax, color="#005f99", linewidth=2.5, label="Main River")
-
-# Overlay anomaly points
-critical_points.plot(ax=ax, color="black", markersize=20, label="Main River Anomalies")
-
-# Final layout
-ax.legend(title="Fault Type", loc="upper left")
-plt.title("Basin 1: Fault Types, Main River and VU Anomalies")
-plt.tight_layout()
-plt.savefig(output_path, dpi=300)
-plt.close()
-
-print(f"✅ Overlay plot saved to: {output_path}")
+max_proximity_dist = 20000
+
+def load_fault_rules(path=fault_rules_path):
+    if os.path.exists(path):
+        table = pd.read_csv(path)
+        return list(zip(table["pattern"].astype(str), table["fault_type"].astype(str)))
+    return fault_rules
+
+def classify_faults(descriptions, rules):
+    """Fault type per feature, testing each distinct description against the rules once"""
+    codes, uniques = pd.factorize(descriptions, use_na_sentinel=False)
+    uniques = pd.Series(uniques, dtype=object).astype(str).str.lower()
+    types = np.full(len(uniques), default_fault_type, dtype=object)
+    unassigned = np.ones(len(uniques), dtype=bool)
+    for pattern, fault_type in rules:
+        hit = unassigned & uniques.str.contains(pattern.lower(), regex=False).to_numpy()
+        types[hit] = fault_type
+        unassigned &= ~hit
+    return pd.Categorical(types[codes], categories=sorted(pd.unique(types)))
+
+def load_faults(path=faults_path, crs=None):
+    """Read and classify the fault layer"""
+    faults = gpd.read_file(path)
+    if crs is not None:
+        faults = faults.to_crs(crs)
+
+    # Identify proper attribute field
+    possible_fields = ["Fea_En", "NAME", "Type", "description"]
+    fault_field = next((f for f in possible_fields if f in faults.columns), None)
+    if not fault_field:
+        raise ValueError("❌ Could not find a suitable fault description field.")
+
+    # Apply classification
+    faults["Fault_Type"] = classify_faults(faults[fault_field], load_fault_rules())
+    return faults
+
+def load_points(path, crs):
+    points = read_table(path, columns=point_columns).to_crs(crs)
+
+    # Ensure Vu_zscore exists
+    if "Vu_zscore" not in points.columns:
+        points["Vu_zscore"] = zscores(points, "Vu1")
+    return points
+
+def fault_distances(point_geoms, faults, max_distance=max_proximity_dist):
+    """Distance from every point to the nearest fault of each type (NaN beyond max_distance),
+    plus the overall nearest fault's distance and type"""
+    table = pd.DataFrame(index=range(len(point_geoms)))
+    for ftype, group in faults.groupby("Fault_Type", observed=True):
+        tree = shapely.STRtree(group.geometry.values)
+        (point_idx, _), dist = tree.query_nearest(point_geoms, max_distance=max_distance,
+                                                  return_distance=True, all_matches=False)
+        column = np.full(len(point_geoms), np.nan)
+        column[point_idx] = dist
+        table[f"Dist_{ftype}"] = column
+
+    dist_columns = table.columns
+    near_any = table[dist_columns].notna().any(axis=1).to_numpy()
+    nearest = np.full(len(table), np.nan)
+    nearest_type = np.full(len(table), None, dtype=object)
+    if len(dist_columns):
+        values = table[dist_columns].to_numpy()
+        closest = np.argmin(np.where(np.isnan(values), np.inf, values), axis=1)
+        nearest[near_any] = values[near_any, closest[near_any]]
+        nearest_type[near_any] = np.array([c[len("Dist_"):] for c in dist_columns])[closest[near_any]]
+    table["Nearest_Fault_Distance"] = nearest
+    table["Nearest_Fault_Type"] = nearest_type
+    return table
+
+def proximity_summary(distances, zscore, buffer_dist=buffer_dist):
+    """Anomaly counts per fault type for points within buffer_dist of a fault of that type"""
+    if buffer_dist > max_proximity_dist:
+        raise ValueError(f"buffer_dist {buffer_dist} exceeds max_proximity_dist {max_proximity_dist}")
+    is_anomaly = np.abs(np.asarray(zscore)) > 2
+    records = []
+    for column in [c for c in distances.columns if c.startswith("Dist_")]:
+        near = (distances[column] <= buffer_dist).to_numpy()
+        n_near, n_anomalies = int(near.sum()), int((near & is_anomaly).sum())
+        records.append({
+            "Fault Type": column[len("Dist_"):],
+            "Anomalies Near Fault": n_anomalies,
+            "Total Points Near Fault": n_near,
+            "Anomaly Density (per 100 pts)": (n_anomalies / max(n_near, 1)) * 100
+        })
+    return pd.DataFrame(records)
+
+def fault_overlay(basin, points, faults, output_dir=output_dir, basin_label="Basin 1"):
+    """Proximity tables and the fault/VU overlay figure for one basin.
+
+    faults may be the whole layer or any subset covering the basin; it is
+    clipped to the basin here.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, "faults_vu_overlay.png")
+    summary_table_path = os.path.join(output_dir, "fault_proximity_anomalies.csv")
+    point_distances_path = os.path.join(output_dir, "fault_distances.parquet")
+
+    # Clip faults to basin extent
+    faults_clipped = gpd.clip(faults, basin)
+
+    # Identify main river
+    main_river_id = points.groupby("River_ID").size().idxmax()
+    main_river = points[points["River_ID"] == main_river_id].sort_values("Order").reset_index(drop=True)
+
+    # Detect anomalies
+    main_river["Anomaly"] = np.where(main_river["Vu_zscore"].abs() > 2, "Anomaly", "Normal")
+    critical_points = main_river[main_river["Anomaly"] == "Anomaly"]
+
+    distances = fault_distances(points.geometry.values, faults_clipped)
+    write_table(pd.concat([points[["River_ID", "Order", "Vu_zscore"]].reset_index(drop=True), distances], axis=1),
+                point_distances_path)
+    print(f"✅ Nearest-fault distances saved to: {point_distances_path}")
+
+    summary_df = proximity_summary(distances, points["Vu_zscore"])
+    summary_df.to_csv(summary_table_path, index=False)
+    print(f"✅ Proximity anomaly summary saved to: {summary_table_path}")
+
+    # Plot
+    fig, ax = plt.subplots(figsize=(12, 8))
+    basin.boundary.plot(ax=ax, color="black", linewidth=1)
+    points.plot(ax=ax, column="Vu_zscore", cmap="coolwarm", markersize=3, legend=True, vmin=-3, vmax=3)
+
+    # Faults by type (types from a custom rule table fall back to grey)
+    for ftype in dict.fromkeys(list(fault_colors) + list(faults_clipped["Fault_Type"].unique())):
+        subset = faults_clipped[faults_clipped["Fault_Type"] == ftype]
+        if not subset.empty:
+            subset.plot(ax=ax, linewidth=1.5, color=fault_colors.get(ftype, "grey"), label=ftype)
+
+    # Dissolve main river and plot
+    main_river_line = main_river.unary_union
+    if isinstance(main_river_line, (LineString, MultiLineString)):
+        gpd.GeoSeries([main_river_line], crs=points.crs).plot(ax=ax, color="#005f99", linewidth=2.5, label="Main River")
+
+    # Overlay anomaly points
+    critical_points.plot(ax=ax, color="black", markersize=20, label="Main River Anomalies")
+
+    # Final layout
+    ax.legend(title="Fault Type", loc="upper left")
+    plt.title(f"{basin_label}: Fault Types, Main River and VU Anomalies")
+    plt.tight_layout()
+    plt.savefig(output_path, dpi=300)
+    plt.close()
+
+    print(f"✅ Overlay plot saved to: {output_path}")
+    return summary_df
+
+def main():
+    # Load datasets
+    basin = gpd.read_file(basin_path).explode(index_parts=False)
+    faults = load_faults(faults_path, basin.crs)
+    points = load_points(points_path, basin.crs)
+    fault_overlay(basin, points, faults)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import geopandas as gpd
+import pandas as pd
+import pyarrow.ipc
+import pyarrow.parquet as pq
+import pyogrio
+
+# Shared table I/O for the pipeline scripts. The file extension picks the
+# format: GeoParquet (.parquet), Arrow IPC/Feather (.feather, .arrow), CSV,
+# or any vector format GDAL can write (.shp, .gpkg, ...). A directory with
+# one of the columnar extensions is treated as an append-only set of parts.
+
+PARQUET_EXTS = (".parquet", ".geoparquet")
+ARROW_EXTS = (".feather", ".arrow", ".ipc")
+
+def table_format(path):
+    """Format name for a path: "parquet", "arrow", "csv" or "vector" """
+    ext = os.path.splitext(str(path).rstrip("/\\"))[1].lower()
+    if ext in PARQUET_EXTS:
+        return "parquet"
+    if ext in ARROW_EXTS:
+        return "arrow"
+    if ext == ".csv":
+        return "csv"
+    return "vector"
+
+def _part_files(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path)
+                      if not name.startswith("."))
+    return [path]
+
+def _schema(path, fmt):
+    if fmt == "parquet":
+        return pq.read_schema(path)
+    with pyarrow.ipc.open_file(path) as reader:
+        return reader.schema
+
+def available_columns(path):
+    """Column names stored in a table, without reading any rows"""
+    fmt = table_format(path)
+    first = _part_files(path)[0]
+    if fmt in ("parquet", "arrow"):
+        return list(_schema(first, fmt).names)
+    if fmt == "csv":
+        return list(pd.read_csv(first, nrows=0).columns)
+    info = pyogrio.read_info(first)
+    return list(info["fields"]) + ["geometry"]
+
+def _read_part(path, fmt, columns):
+    if fmt == "csv":
+        return pd.read_csv(path, usecols=columns)
+    if fmt == "vector":
+        attrs = None if columns is None else [c for c in columns if c != "geometry"]
+        return gpd.read_file(path, columns=attrs)
+
+    is_geo = b"geo" in (_schema(path, fmt).metadata or {})
+    if fmt == "parquet":
+        reader = gpd.read_parquet if is_geo else pd.read_parquet
+    else:
+        reader = gpd.read_feather if is_geo else pd.read_feather
+    return reader(path, columns=columns)
+
+def read_table(path, columns=None):
+    """Read a table or layer, loading only the requested columns.
+
+    Requested columns missing from the file are skipped so that callers can
+    report them with their own validation.
+    """
+    fmt = table_format(path)
+    if columns is not None:
+        stored = set(available_columns(path))
+        columns = [c for c in columns if c in stored]
+
+    parts = [_read_part(part, fmt, columns) for part in _part_files(path)]
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts, ignore_index=True)
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.isfile(path) and table_format(path) != "vector":
+        os.remove(path)
+
+def write_table(df, path, part=None):
+    """Write a (Geo)DataFrame in the format implied by path.
+
+    With part set, columnar formats write part-NNNNN files into the path
+    directory (part 0 clears it first) and vector/CSV outputs append.
+    """
+    fmt = table_format(path)
+    if not part:
+        _remove(path)
+    if part is not None and fmt in ("parquet", "arrow"):
+        if part == 0:
+            os.makedirs(path)
+        ext = os.path.splitext(path.rstrip("/\\"))[1]
+        path = os.path.join(path, f"part-{part:05d}{ext}")
+    elif os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    append = bool(part)
+    if fmt == "parquet":
+        df.to_parquet(path, index=False)
+    elif fmt == "arrow":
+        df.reset_index(drop=True).to_feather(path)
+    elif fmt == "csv":
+        df.to_csv(path, index=False, mode="a" if append else "w", header=not append)
+    else:
+        df.to_file(path, mode="a" if append else "w")
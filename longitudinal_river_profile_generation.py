@@ -1,62 +1,147 @@
 import geopandas as gpd
+import matplotlib
 import matplotlib.pyplot as plt
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 import numpy as np
 
+from geo_io import read_table
+from river_distance import add_cumulative_distance, group_starts
+
 # Load shapefile
 shp_path = "rivers_overlap_basins/rivers_overlap_basin_1_interpolated_points_elevation_vu.shp"
-gdf = gpd.read_file(shp_path)
-
-# Ensure required columns are present
 required_cols = ["River_ID", "Order", "Elevation1", "Vu1"]
-missing = [col for col in required_cols if col not in gdf.columns]
-if missing:
-    raise ValueError(f"Missing columns: {missing}")
-
-# Sort and compute cumulative distance
-def compute_cumulative_distance(coords):
-    dists = [0]
-    for i in range(1, len(coords)):
-        dist = coords[i].distance(coords[i - 1])
-        dists.append(dists[-1] + dist)
-    return dists
-
-def compute_profiles(gdf):
-    plots_folder = "rivers_overlap_basins/basin_1_plots"
-    os.makedirs(plots_folder, exist_ok=True)
+plots_folder = "rivers_overlap_basins/basin_1_plots"
+
+min_points = 20
+smooth_window = 11
+
+# Rendering: worker processes each reuse one figure; with skip_unchanged only
+# rivers whose profile hash differs from the last run are redrawn
+n_workers = max(1, (os.cpu_count() or 2) - 1)
+skip_unchanged = True
+hash_manifest = os.path.join(plots_folder, "profile_hashes.json")
+
+def load_points(path=shp_path):
+    gdf = read_table(path, columns=required_cols + ["geometry"])
+
+    # Ensure required columns are present
+    missing = [col for col in required_cols if col not in gdf.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {missing}")
+    return gdf
+
+def smooth_by_river(values, starts, sizes, window):
+    """Centred rolling mean within each river (NaN where the window would cross a river end)"""
+    half = window // 2
+    kernel = np.ones(window) / window
+    smooth = np.full(len(values), np.nan)
+    if len(values) < window:
+        return smooth
+    smooth[half:len(values) - half] = np.convolve(values, kernel, mode="valid")
+
+    position = np.arange(len(values)) - np.repeat(starts, sizes)
+    crosses = (position < half) | (position >= np.repeat(sizes, sizes) - half)
+    smooth[crosses] = np.nan
+    return smooth
+
+def profile_tasks(gdf):
+    """Small per-river arrays (distance, smoothed elevation and VU) for the renderer"""
+    # Sort and compute cumulative distance for every river at once
+    gdf = add_cumulative_distance(gdf)
+    river_ids = gdf["River_ID"].to_numpy()
+    starts = np.flatnonzero(group_starts(river_ids))
+    sizes = np.diff(np.append(starts, len(gdf)))
 
-    for river_id, group in tqdm(gdf.groupby("River_ID"), desc="Generating river profiles"):
-        if len(group) < 20:
+    distance_km = gdf["Distance_m"].to_numpy() / 1000  # convert m to km
+    elevation = smooth_by_river(gdf["Elevation1"].to_numpy(dtype=float), starts, sizes, smooth_window)
+    vu = smooth_by_river(gdf["Vu1"].to_numpy(dtype=float), starts, sizes, smooth_window)
+
+    for start, size in zip(starts, sizes):
+        if size < min_points:
             continue
+        block = slice(start, start + size)
+        yield river_ids[start], distance_km[block], elevation[block], vu[block]
+
+def profile_hash(river_id, distance_km, elevation, vu):
+    digest = hashlib.sha1(str(river_id).encode())
+    for values in (distance_km, elevation, vu):
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+_figure = None
+
+def init_worker():
+    """Build the figure template once per worker process"""
+    global _figure
+    matplotlib.use("Agg")
+    fig, ax1 = plt.subplots(figsize=(10, 5))
+    elevation_line, = ax1.plot([], [], color="blue", label="Elevation (m)")
+    ax1.set_xlabel("Distance (km)")
+    ax1.set_ylabel("Elevation (m)", color="blue")
+    ax1.tick_params(axis='y', labelcolor="blue")
+
+    ax2 = ax1.twinx()
+    vu_line, = ax2.plot([], [], color="red", linestyle="dashed", label="VU (mm/year)")
+    ax2.set_ylabel("VU (mm/year)", color="red")
+    ax2.tick_params(axis='y', labelcolor="red")
+    _figure = (fig, ax1, ax2, elevation_line, vu_line)
 
-        group_sorted = group.sort_values("Order").reset_index(drop=True)
-        coords = group_sorted.geometry
-        dists = compute_cumulative_distance(coords)
-        group_sorted["Distance_km"] = np.array(dists) / 1000  # convert m to km
+def render_profile(task):
+    """Draw one river into the worker's figure and save it"""
+    river_id, distance_km, elevation, vu, path = task
+    fig, ax1, ax2, elevation_line, vu_line = _figure
+    elevation_line.set_data(distance_km, elevation)
+    vu_line.set_data(distance_km, vu)
+    for ax in (ax1, ax2):
+        ax.relim()
+        ax.autoscale_view()
 
-        # Apply rolling smoothing
-        window = 11 if len(group_sorted) >= 11 else max(3, len(group_sorted) // 2 * 2 + 1)
-        group_sorted["Elevation_smooth"] = group_sorted["Elevation1"].rolling(window, center=True).mean()
-        group_sorted["Vu_smooth"] = group_sorted["Vu1"].rolling(window, center=True).mean()
+    ax2.set_title(f"Smoothed River Profile: {river_id}")
+    fig.tight_layout()
+    fig.savefig(path)
+    return river_id
 
-        # Plot
-        fig, ax1 = plt.subplots(figsize=(10, 5))
-        ax1.plot(group_sorted["Distance_km"], group_sorted["Elevation_smooth"], color="blue", label="Elevation (m)")
-        ax1.set_xlabel("Distance (km)")
-        ax1.set_ylabel("Elevation (m)", color="blue")
-        ax1.tick_params(axis='y', labelcolor="blue")
+def load_manifest():
+    if skip_unchanged and os.path.exists(hash_manifest):
+        with open(hash_manifest) as f:
+            return json.load(f)
+    return {}
+
+def compute_profiles(gdf, workers=None):
+    os.makedirs(plots_folder, exist_ok=True)
+    workers = workers or n_workers
+    manifest = load_manifest()
+
+    tasks, hashes = [], {}
+    for river_id, distance_km, elevation, vu in profile_tasks(gdf):
+        path = f"{plots_folder}/{river_id}_profile.png"
+        key = str(river_id)
+        hashes[key] = profile_hash(river_id, distance_km, elevation, vu)
+        if manifest.get(key) == hashes[key] and os.path.exists(path):
+            continue
+        tasks.append((river_id, distance_km, elevation, vu, path))
+    print(f"{len(tasks)} of {len(hashes)} profiles to draw")
 
-        ax2 = ax1.twinx()
-        ax2.plot(group_sorted["Distance_km"], group_sorted["Vu_smooth"], color="red", linestyle="dashed", label="VU (mm/year)")
-        ax2.set_ylabel("VU (mm/year)", color="red")
-        ax2.tick_params(axis='y', labelcolor="red")
+    if workers == 1:
+        init_worker()
+        done = [render_profile(task) for task in tqdm(tasks, desc="Generating river profiles")]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            done = list(tqdm(pool.map(render_profile, tasks, chunksize=16),
+                             total=len(tasks), desc="Generating river profiles"))
 
-        plt.title(f"Smoothed River Profile: {river_id}")
-        plt.tight_layout()
-        plt.savefig(f"{plots_folder}/{river_id}_profile.png")
-        plt.close()
+    if skip_unchanged:
+        manifest.update({str(river_id): hashes[str(river_id)] for river_id in done})
+        with open(hash_manifest, "w") as f:
+            json.dump(manifest, f)
 
-compute_profiles(gdf)
-print("✅ Smoothed longitudinal profiles generated from shapefile.")
+def main():
+    compute_profiles(load_points())
+    print("✅ Smoothed longitudinal profiles generated from shapefile.")
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import numpy as np
+from affine import Affine
+
+import terrain_analysis as ta
+import stream_extraction as se
+from geo_io import write_table
+
+# Single in-memory run of the DEM -> stream network workflow. Rasters stay as
+# whitebox_workflows objects from the DEM to the stream raster, which is traced
+# into links in-process; nothing is written to disk unless it is listed in
+# write_outputs.
+wbe = ta.wbe
+threshold = 3000
+basin_shp = se.basin_shp
+
+# Any of the terrain products ("filled", "flowdir", "flowacc", ...) plus "streams"
+# (stream raster), "streams_vector" (unclipped network) and "streams_clipped"
+write_outputs = []
+stream_raster = os.path.join(ta.output_dir, "streams.tif")
+stream_vector = os.path.join(ta.output_dir, "streams_vectorized.parquet")
+
+def raster_crs(raster):
+    """CRS of a whitebox_workflows raster, preferring its EPSG code"""
+    if raster.configs.epsg_code:
+        return f"EPSG:{raster.configs.epsg_code}"
+    return raster.configs.coordinate_ref_system_wkt
+
+def raster_to_array(raster):
+    """Cell values and affine transform of a whitebox_workflows raster"""
+    configs = raster.configs
+    values = np.array([raster.get_row_data(row) for row in range(configs.rows)])
+    transform = Affine(configs.resolution_x, 0.0, configs.west, 0.0, -configs.resolution_y, configs.north)
+    return values, transform
+
+def compute_rasters(names, outputs=()):
+    """Chain the terrain tools in memory, writing only the requested products"""
+    rasters = {"dem": wbe.read_raster(ta.input_dem)}
+    for name in ta.with_dependencies(names):
+        rasters[name] = ta.product_tool(name)(rasters[ta.PRODUCTS[name][1]])
+        if name in outputs:
+            wbe.write_raster(rasters[name], ta.new_output(name))
+    return rasters
+
+def extract_network(flow_acc, pointer, threshold, outputs=()):
+    """Stream raster and vectorized network straight from in-memory rasters"""
+    streams = wbe.extract_streams(flow_acc, threshold=float(threshold))
+    streams.update_min_max()
+    if not streams.configs.maximum > 0:
+        raise ValueError("No streams detected! Lower the threshold.")
+    if "streams" in outputs:
+        wbe.write_raster(streams, stream_raster)
+
+    stream_values, transform = raster_to_array(streams)
+    pointer_values, _ = raster_to_array(pointer)
+    network = se.trace_streams(stream_values > 0, pointer_values, transform, raster_crs(flow_acc))
+    if "streams_vector" in outputs:
+        write_table(network, stream_vector)
+    return network
+
+def run_pipeline(threshold=threshold, outputs=None, show_plot=True):
+    """DEM -> filled DEM -> pointer/accumulation -> streams -> clipped network and drainage density"""
+    outputs = write_outputs if outputs is None else outputs
+    os.makedirs(ta.output_dir, exist_ok=True)
+
+    print("\n=== Hydrological Rasters ===")
+    rasters = compute_rasters(["flowdir", "flowacc"] + [o for o in outputs if o in ta.PRODUCTS], outputs)
+
+    print("\n=== Extracting Streams ===")
+    network = extract_network(rasters["flowacc"], rasters["flowdir"], threshold, outputs)
+    dem_crs = raster_crs(rasters["flowacc"])
+    del rasters
+    print(f"Extracted {len(network)} stream segments")
+
+    basin_gdf = se.load_basin(basin_shp, dem_crs)
+    clipped = se.clip_streams(network, basin_gdf)
+    output_label = "(kept in memory)"
+    if "streams_clipped" in outputs:
+        write_table(clipped, se.clipped_streams)
+        output_label = se.clipped_streams
+    density = se.report_drainage_density(clipped, basin_gdf, output_label, show_plot=show_plot)
+    return clipped, density
+
+def main():
+    run_pipeline()
+    print("\n=== Pipeline Complete ===")
+
+if __name__ == "__main__":
+    main()
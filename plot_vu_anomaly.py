@@ -3,45 +3,56 @@ import matplotlib.pyplot as plt
 from matplotlib.colors import Normalize
 import os
 
+from anomaly_stats import zscores
+from geo_io import read_table
+
 # Paths
 points_fp = "rivers_overlap_basins/rivers_overlap_basin_1_interpolated_points_50_elevation_vu.shp"
 basin_fp = "hybas4_selected_subbasin_1.shp"
-
-# Load data
-points_gdf = gpd.read_file(points_fp)
-basin_gdf = gpd.read_file(basin_fp)
-
-# Fix any invalid geometries in basin
-basin_gdf["geometry"] = basin_gdf["geometry"].buffer(0)
-
-# Match CRS
-points_gdf = points_gdf.to_crs(basin_gdf.crs)
-
-# Clip points
-clipped_points = gpd.clip(points_gdf, basin_gdf)
-
-# Calculate Vu z-score
-vu_mean = clipped_points["Vu1"].mean()
-vu_std = clipped_points["Vu1"].std()
-clipped_points["Vu_zscore"] = (clipped_points["Vu1"] - vu_mean) / vu_std
-
-# Plot
-fig, ax = plt.subplots(figsize=(10, 6))
-norm = Normalize(vmin=-3, vmax=3)
-
-clipped_points.plot(
-    ax=ax,
-    column="Vu_zscore",
-    cmap="coolwarm",
-    markersize=5,
-    legend=True,
-    norm=norm
-)
-
-basin_gdf.boundary.plot(ax=ax, edgecolor='black')
-ax.set_title("VU Z-score Anomalies in Basin 1")
-ax.set_axis_off()
-plt.tight_layout()
-plt.savefig("rivers_overlap_basins/basin_1_vu_zscore_map.png", dpi=300)
-plt.show()
-
+output_fp = "rivers_overlap_basins/basin_1_vu_zscore_map.png"
+
+def plot_zscore_map(points_gdf, basin_gdf, output_path, basin_label="Basin 1", show=True):
+    """Map the basin's points coloured by VU z-score computed within the basin"""
+    # Fix any invalid geometries in basin
+    basin_gdf = basin_gdf.copy()
+    basin_gdf["geometry"] = basin_gdf["geometry"].buffer(0)
+
+    # Match CRS
+    points_gdf = points_gdf.to_crs(basin_gdf.crs)
+
+    # Clip points
+    clipped_points = gpd.clip(points_gdf, basin_gdf)
+
+    # Calculate Vu z-score over the clipped points
+    clipped_points["Vu_zscore"] = zscores(clipped_points, "Vu1")
+
+    # Plot
+    fig, ax = plt.subplots(figsize=(10, 6))
+    norm = Normalize(vmin=-3, vmax=3)
+
+    clipped_points.plot(
+        ax=ax,
+        column="Vu_zscore",
+        cmap="coolwarm",
+        markersize=5,
+        legend=True,
+        norm=norm
+    )
+
+    basin_gdf.boundary.plot(ax=ax, edgecolor='black')
+    ax.set_title(f"VU Z-score Anomalies in {basin_label}")
+    ax.set_axis_off()
+    plt.tight_layout()
+    plt.savefig(output_path, dpi=300)
+    if show:
+        plt.show()
+    plt.close(fig)
+
+def main():
+    # Load data
+    points_gdf = read_table(points_fp, columns=["Vu1", "geometry"])
+    basin_gdf = gpd.read_file(basin_fp)
+    plot_zscore_map(points_gdf, basin_gdf, output_fp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy.signal import savgol_coeffs
+
+from geo_io import read_table
+from river_distance import add_cumulative_distance, group_starts
+
+# Along-profile VU anomalies for every river. Each point is scored against its
+# own stretch of channel (rolling median/MAD, or the residual from a
+# Savitzky-Golay fit scaled by the river's MAD), and consecutive flagged
+# points are merged into anomaly segments.
+basin_point_paths = {
+    "basin_1": "rivers_overlap_basins/rivers_overlap_basin_1_interpolated_points_50_elevation_vu.shp",
+}
+output_path = "rivers_overlap_basins/vu_anomaly_segments.csv"
+
+method = "mad"  # "mad" (rolling median/MAD) or "savgol" (Savitzky-Golay residual)
+window = 21  # points per local window (odd)
+polyorder = 3  # Savitzky-Golay polynomial order
+score_threshold = 3.5  # robust |z| above which a point is anomalous
+min_segment_points = 2
+mad_floor = 0.1  # local MAD is floored at this fraction of the river's overall MAD
+MAD_SCALE = 1.4826  # makes the MAD consistent with the standard deviation for normal data
+
+def robust_score(deviation, mad):
+    """Deviation in MAD units; no score (NaN) where the MAD is zero"""
+    scale = MAD_SCALE * np.asarray(mad, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(scale > 0, np.asarray(deviation, dtype=float) / scale, np.nan)
+
+def rolling_mad_scores(points, column, window):
+    """Robust z-score of each point against the centred rolling median and MAD of its river.
+
+    Flat stretches would have a zero local MAD, so it is floored at mad_floor
+    times the river's overall MAD.
+    """
+    rolling = dict(window=window, center=True, min_periods=window // 2 + 1)
+    grouped = points.groupby("River_ID", sort=False)[column]
+    median = grouped.rolling(**rolling).median().to_numpy()
+
+    deviation = (points[column] - median).abs()
+    mad = deviation.groupby(points["River_ID"], sort=False).rolling(**rolling).median().to_numpy()
+
+    river_deviation = (points[column] - grouped.transform("median")).abs()
+    river_mad = river_deviation.groupby(points["River_ID"], sort=False).transform("median").to_numpy()
+    return robust_score(points[column].to_numpy() - median, np.fmax(mad, mad_floor * river_mad))
+
+def savgol_scores(points, column, window, polyorder):
+    """Residuals from a per-river Savitzky-Golay fit, scaled by each river's residual MAD.
+
+    The fit is one global convolution; points whose window would cross a
+    river end get no score.
+    """
+    values = points[column].to_numpy(dtype=float)
+    half = window // 2
+    fitted = np.full(len(values), np.nan)
+    if len(values) >= window:
+        fitted[half:len(values) - half] = np.convolve(values, savgol_coeffs(window, polyorder), mode="valid")
+
+    starts = np.flatnonzero(group_starts(points["River_ID"].to_numpy()))
+    sizes = np.diff(np.append(starts, len(values)))
+    position = np.arange(len(values)) - np.repeat(starts, sizes)
+    fitted[(position < half) | (position >= np.repeat(sizes, sizes) - half)] = np.nan
+
+    residual = pd.Series(values - fitted, index=points.index)
+    by_river = residual.groupby(points["River_ID"], sort=False)
+    centre = by_river.transform("median")
+    mad = (residual - centre).abs().groupby(points["River_ID"], sort=False).transform("median")
+    return robust_score((residual - centre).to_numpy(), mad.to_numpy())
+
+def anomaly_scores(points, column="Vu1", method=method, window=window, polyorder=polyorder):
+    """Local anomaly score for every point of (River_ID, Order)-sorted points"""
+    if method == "mad":
+        return rolling_mad_scores(points, column, window)
+    if method == "savgol":
+        return savgol_scores(points, column, window, polyorder)
+    raise ValueError(f"Unknown anomaly method: {method}")
+
+def anomaly_segments(points, scores, threshold=score_threshold, min_points=min_segment_points):
+    """Runs of consecutive anomalous points within a river, one row per run"""
+    flagged = np.abs(np.nan_to_num(scores)) > threshold
+    # A run also breaks where the sign flips (a high next to a low)
+    sign = np.sign(np.nan_to_num(scores))
+    new_run = flagged & (group_starts(points["River_ID"].to_numpy())
+                         | ~np.r_[False, flagged[:-1]] | (sign != np.r_[0, sign[:-1]]))
+    run = np.cumsum(new_run)[flagged]
+
+    runs = pd.DataFrame({
+        "Run": run,
+        "River_ID": points["River_ID"].to_numpy()[flagged],
+        "Distance_m": points["Distance_m"].to_numpy()[flagged],
+        "Score": scores[flagged],
+        "Abs_Score": np.abs(scores[flagged]),
+    })
+    peak = runs.loc[runs.groupby("Run")["Abs_Score"].idxmax(), ["Run", "Score"]].set_index("Run")["Score"]
+    segments = runs.groupby("Run").agg(
+        River_ID=("River_ID", "first"),
+        Start_Distance_m=("Distance_m", "min"),
+        End_Distance_m=("Distance_m", "max"),
+        Num_Points=("Score", "size"),
+    )
+    segments["Peak_Score"] = peak
+    segments["Direction"] = np.where(segments["Peak_Score"] > 0, "High", "Low")
+    return segments[segments["Num_Points"] >= min_points].reset_index(drop=True)
+
+def detect(points, column="Vu1"):
+    """Anomaly segments for every river of one point set"""
+    points = add_cumulative_distance(points)
+    scores = anomaly_scores(points, column)
+    return anomaly_segments(points, scores)
+
+def main():
+    tables = []
+    for basin, path in basin_point_paths.items():
+        points = read_table(path, columns=["River_ID", "Order", "Vu1", "geometry"])
+        segments = detect(points)
+        segments.insert(0, "Basin", basin)
+        tables.append(segments)
+        print(f"{basin}: {len(segments)} anomaly segments on {segments['River_ID'].nunique()} rivers")
+
+    table = pd.concat(tables, ignore_index=True)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    table.to_csv(output_path, index=False)
+    print(f"✅ Anomaly segments saved to: {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import shapely
+from pyproj import CRS, Transformer
+from rasterio.windows import Window
+
+from DEM_Stream_cleaning_p2 import downstream_links, fast_extract_endpoints
+from geo_io import read_table, write_table
+
+# Densifies the reconstructed river network into evenly spaced points and
+# samples elevation and vertical uplift onto them, producing the
+# *_interpolated_points_<spacing>_elevation_vu tables the profile scripts read.
+rivers_path = "DEM/outputs/streams_reconstructed_topo.parquet"
+dem_path = "DEM/outputs/COP30_VRT_DEM.tif"
+vu_path = "VU/vertical_uplift_mm_yr.tif"
+
+spacing = 50  # metres between points along each segment
+sampling = "bilinear"  # or "nearest"
+block_size = 2048  # raster rows/columns read per block
+
+# One points file per basin_group; .shp keeps the existing scripts' paths working
+output_template = "rivers_overlap_basins/rivers_overlap_basin_{basin}_interpolated_points_{spacing}_elevation_vu.shp"
+
+def densify(lines, spacing):
+    """Evenly spaced points along every line, starting at each line's first vertex.
+
+    Returns the source line of each point and its distance along that line.
+    """
+    lengths = shapely.length(lines)
+    counts = np.maximum(np.ceil(lengths / spacing).astype(np.int64), 1)
+    line_idx = np.repeat(np.arange(len(lines)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    along = (np.arange(counts.sum()) - starts) * float(spacing)
+    return line_idx, along, shapely.line_interpolate_point(lines[line_idx], along)
+
+def sample_block(data, rows, cols, method):
+    """Sample one block at fractional pixel coordinates relative to its origin"""
+    if method == "nearest":
+        r = np.clip(np.floor(rows).astype(np.int64), 0, data.shape[0] - 1)
+        c = np.clip(np.floor(cols).astype(np.int64), 0, data.shape[1] - 1)
+        return data[r, c]
+
+    # Bilinear between the four surrounding cell centres
+    r, c = rows - 0.5, cols - 0.5
+    r0 = np.clip(np.floor(r).astype(np.int64), 0, data.shape[0] - 1)
+    c0 = np.clip(np.floor(c).astype(np.int64), 0, data.shape[1] - 1)
+    r1 = np.minimum(r0 + 1, data.shape[0] - 1)
+    c1 = np.minimum(c0 + 1, data.shape[1] - 1)
+    fr = np.clip(r - r0, 0, 1)
+    fc = np.clip(c - c0, 0, 1)
+    top = data[r0, c0] * (1 - fc) + data[r0, c1] * fc
+    bottom = data[r1, c0] * (1 - fc) + data[r1, c1] * fc
+    return top * (1 - fr) + bottom * fr
+
+def sample_raster(path, x, y, crs=None, method=None, block=None):
+    """Raster values at many points, reading only the blocks that contain points.
+
+    Points in another CRS than the raster are reprojected first. Nodata and
+    points outside the raster come back as NaN.
+    """
+    method = method or sampling
+    block = block or block_size
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    values = np.full(len(x), np.nan)
+    with rasterio.open(path) as src:
+        if crs is not None and src.crs is None:
+            raise ValueError(f"❌ {path} has no CRS; cannot sample points in {crs}")
+        if crs is not None and CRS.from_user_input(crs) != CRS.from_user_input(src.crs):
+            x, y = Transformer.from_crs(crs, src.crs, always_xy=True).transform(x, y)
+        cols, rows = ~src.transform * (x, y)
+        inside = np.flatnonzero((rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width))
+        block_r = (rows[inside] // block).astype(np.int64)
+        block_c = (cols[inside] // block).astype(np.int64)
+        key = block_r * (src.width // block + 1) + block_c
+
+        order = np.argsort(key, kind="stable")
+        inside, key = inside[order], key[order]
+        bounds = np.flatnonzero(np.r_[True, key[1:] != key[:-1], True])
+        halo = 1 if method == "bilinear" else 0
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            points = inside[start:end]
+            row0 = max(int(rows[points[0]] // block) * block - halo, 0)
+            col0 = max(int(cols[points[0]] // block) * block - halo, 0)
+            window = Window(col0, row0,
+                            min(block + 2 * halo, src.width - col0),
+                            min(block + 2 * halo, src.height - row0))
+            data = src.read(1, window=window, masked=True).astype(float).filled(np.nan)
+            values[points] = sample_block(data, rows[points] - row0, cols[points] - col0, method)
+    return values
+
+def river_paths(rivers):
+    """Split every River_ID network into single source-to-junction paths.
+
+    At each confluence the tributary with the longest upstream path
+    (cumulative_distance) carries the path on, so the first path of every
+    network is its longest source-to-outlet chain. Returns a path number per
+    segment, counted from 1 with each network's longest path first.
+    """
+    n = len(rivers)
+    network = rivers["River_ID"].to_numpy()
+    dist_up = rivers["cumulative_distance"].to_numpy()
+    start_coords, end_coords = fast_extract_endpoints(rivers.geometry.values)
+    down = downstream_links(start_coords, end_coords)
+    down[(down >= 0) & (network[np.maximum(down, 0)] != network)] = -1
+
+    # The longest inflow to each segment continues its path; the others end there
+    inflow = np.flatnonzero(down >= 0)
+    inflow = inflow[np.lexsort((-dist_up[inflow], down[inflow]))]
+    main = inflow[np.r_[True, down[inflow][1:] != down[inflow][:-1]]]
+    parent = np.arange(n)
+    parent[main] = down[main]
+
+    # Follow each segment down its path to the path's last segment
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            break
+        parent = grand
+
+    ends = np.unique(parent)
+    ends = ends[np.lexsort((-dist_up[ends], network[ends]))]
+    path_number = np.zeros(n, dtype=np.int64)
+    path_number[ends] = np.arange(1, len(ends) + 1)
+    return path_number[parent]
+
+def river_points(rivers, point_spacing=None, method=None):
+    """Points along every river path with Order running upstream to downstream.
+
+    River_ID numbers the single paths from river_paths and Network_ID keeps
+    the connected network they belong to. Segments of a path are visited from
+    the farthest from its outlet to the nearest (dist_down, measured from each
+    segment's upstream end), so Order is contiguous within each segment.
+    """
+    point_spacing = point_spacing or spacing
+    method = method or sampling
+    rivers = rivers[~rivers.geometry.is_empty].reset_index(drop=True)
+    path_ids = river_paths(rivers)
+    line_idx, along, geoms = densify(rivers.geometry.values, point_spacing)
+    x, y = shapely.get_x(geoms), shapely.get_y(geoms)
+
+    points = pd.DataFrame({
+        "River_ID": path_ids[line_idx],
+        "Network_ID": rivers["River_ID"].to_numpy()[line_idx],
+        "Segment": line_idx,
+        "Dist_Down": rivers["dist_down"].to_numpy()[line_idx] - along,
+    })
+    if "basin_group" in rivers.columns:
+        points["basin_group"] = rivers["basin_group"].to_numpy()[line_idx]
+
+    upstream_first = np.lexsort((along, -rivers["dist_down"].to_numpy()[line_idx], points["River_ID"].to_numpy()))
+    points = points.iloc[upstream_first].reset_index(drop=True)
+    x, y = x[upstream_first], y[upstream_first]
+    points.insert(1, "Order", points.groupby("River_ID").cumcount().to_numpy())
+
+    print(f"Sampling {len(points)} points along {path_ids.max()} paths ({method})")
+    points["Elevation1"] = sample_raster(dem_path, x, y, rivers.crs, method)
+    points["Vu1"] = sample_raster(vu_path, x, y, rivers.crs, method)
+    return gpd.GeoDataFrame(points, geometry=shapely.points(x, y), crs=rivers.crs)
+
+def main():
+    rivers = read_table(rivers_path, columns=["River_ID", "cumulative_distance", "dist_down", "basin_group", "geometry"])
+    print(f"Loaded {len(rivers)} river segments from {rivers_path}")
+    points = river_points(rivers)
+
+    groups = points.groupby("basin_group") if "basin_group" in points.columns else [(1, points)]
+    for basin, basin_points in groups:
+        if basin == 0:
+            continue  # segments outside every basin
+        output_path = output_template.format(basin=basin, spacing=spacing)
+        write_table(basin_points.drop(columns="basin_group", errors="ignore"), output_path)
+        print(f"✅ {len(basin_points)} points saved to: {output_path}")
+
+if __name__ == "__main__":
+    main()
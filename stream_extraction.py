@@ -1,18 +1,23 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 import whitebox
 import geopandas as gpd
 import rasterio
+import shapely
 import matplotlib.pyplot as plt
 from shapely.geometry import Polygon
 from shapely.validation import make_valid
 
+from geo_io import read_table, write_table
+
 # --- Setup ---
 wbt = whitebox.WhiteboxTools()
 wbt.set_verbose_mode(True)
 
 # --- Path Configuration ---
 base_dir = os.path.abspath("DEM/outputs")
-os.makedirs(base_dir, exist_ok=True)
 
 # Input files
 flow_acc = os.path.join(base_dir, "dem_flowacc.tif").replace("\\", "/")
@@ -22,136 +27,429 @@ basin_shp = os.path.abspath("hybas4_selected_subbasin_1.shp").replace("\\", "/")
 # Output files
 stream_raster = os.path.join(base_dir, "streams.tif").replace("\\", "/")
 stream_vector = os.path.join(base_dir, "streams_vectorized.shp").replace("\\", "/")
-clipped_streams = os.path.join(base_dir, "streams_clipped.gpkg").replace("\\", "/")
-
-# --- Validate Inputs ---
-print("\n=== Input Validation ===")
-required_files = [flow_acc, flow_dir]
-for f in required_files:
-    if not os.path.exists(f):
-        raise FileNotFoundError(f"Missing input file: {f}")
-    print(f"Found: {f}")
-
-# --- DEM CRS Check ---
-with rasterio.open(flow_acc) as src:
-    dem_crs = src.crs
-    print(f"\nDEM CRS: {dem_crs}")
-
-# --- Step 1: Extract Streams ---
-print("\n=== Extracting Streams ===")
-try:
-    wbt.extract_streams(
-        flow_accum=flow_acc,
-        output=stream_raster,
-        threshold=3000
-    )
-    
-    with rasterio.open(stream_raster) as src:
-        if src.read().max() == 0:
-            raise ValueError("No streams detected! Lower the threshold.")
-    print("Stream extraction successful")
-
-except Exception as e:
-    raise RuntimeError(f"Stream extraction failed: {e}")
-
-# --- Step 2: Vectorize Streams ---
-print("\n=== Vectorizing Streams ===")
-try:
-    wbt.raster_streams_to_vector(
-        streams=stream_raster,
-        d8_pntr=flow_dir,
-        output=stream_vector
-    )
-    
-    for ext in [".shp", ".shx", ".dbf"]:
-        if not os.path.exists(stream_vector.replace(".shp", ext)):
-            raise FileNotFoundError(f"Missing {ext} file")
-    print("Vectorization successful")
-
-except Exception as e:
-    raise RuntimeError(f"Vectorization failed: {e}")
-
-# --- Step 3: Process Basin with Robust Fallback ---
-print("\n=== Processing Basin ===")
-try:
-    # Try loading original basin
-    if os.path.exists(basin_shp):
-        basin_gdf = gpd.read_file(basin_shp)
-        print(f"Loaded original basin: {basin_shp}")
-    else:
-        raise FileNotFoundError(f"Basin file not found: {basin_shp}")
-    
-    # CRS handling
-    if basin_gdf.crs != dem_crs:
-        print(f"Reprojecting basin from {basin_gdf.crs} to {dem_crs}")
-        basin_gdf = basin_gdf.to_crs(dem_crs)
-    
-    # Geometry validation
-    if not all(basin_gdf.geometry.is_valid):
-        print("Repairing invalid basin geometries...")
-        basin_gdf.geometry = basin_gdf.geometry.apply(
-            lambda x: make_valid(x) if not x.is_valid else x
-        )
-    
-    # Area check and geometry repair
-    basin_area_m2 = basin_gdf.geometry.area.sum()
-    if basin_area_m2 < 10000:  # Less than 1ha
-        print(f"Small basin detected ({basin_area_m2:.2f} m²), applying buffer...")
-        basin_gdf.geometry = basin_gdf.geometry.buffer(50)  # 50m buffer
+clipped_streams = os.path.join(base_dir, "streams_clipped.parquet").replace("\\", "/")
+
+# Threshold sweep: set to a list of thresholds to calibrate channel initiation in one pass
+sweep_thresholds = None  # e.g. [1000, 2000, 3000, 5000, 10000]
+sweep_workers = 4
+sweep_table = os.path.join(base_dir, "drainage_density_sweep.csv").replace("\\", "/")
+
+# Batch mode: set to a HydroBASINS level layer to get metrics for every polygon in it
+batch_basins = None  # e.g. "hybas_as_lev08_v1c.shp"
+batch_id_column = "HYBAS_ID"
+batch_table = os.path.join(base_dir, "basin_metrics.csv").replace("\\", "/")
+
+def load_basin(basin_shp, dem_crs):
+    """Load, reproject and repair the basin, falling back to a 1 km² test basin"""
+    print("\n=== Processing Basin ===")
+    try:
+        # Try loading original basin
+        if os.path.exists(basin_shp):
+            basin_gdf = gpd.read_file(basin_shp)
+            print(f"Loaded original basin: {basin_shp}")
+        else:
+            raise FileNotFoundError(f"Basin file not found: {basin_shp}")
+
+        # CRS handling
+        if basin_gdf.crs != dem_crs:
+            print(f"Reprojecting basin from {basin_gdf.crs} to {dem_crs}")
+            basin_gdf = basin_gdf.to_crs(dem_crs)
+
+        # Geometry validation
+        if not all(basin_gdf.geometry.is_valid):
+            print("Repairing invalid basin geometries...")
+            basin_gdf.geometry = basin_gdf.geometry.apply(
+                lambda x: make_valid(x) if not x.is_valid else x
+            )
+
+        # Area check and geometry repair
         basin_area_m2 = basin_gdf.geometry.area.sum()
-    
-    print(f"Basin area: {basin_area_m2:.2f} m² ({basin_area_m2/1e6:.3f} km²)")
-
-except Exception as e:
-    print(f"\nWARNING: Basin processing failed ({e}). Creating test basin...")
-    # Create 1km² test basin in UTM Zone 46N
-    test_basin = gpd.GeoDataFrame(geometry=[Polygon([
-        (500000, 3000000),  # UTM coordinates for test area
-        (501000, 3000000),
-        (501000, 3001000),
-        (500000, 3001000)
-    ])], crs="EPSG:32646")
-    basin_gdf = test_basin
-    print("Created 1 km² test basin at UTM (500000,3000000)")
-
-# --- Clip Streams ---
-try:
-    streams = gpd.read_file(stream_vector)
-    streams.crs = dem_crs
-    
-    clipped = gpd.clip(streams, basin_gdf)
-    if len(clipped) == 0:
-        raise ValueError("No streams intersect the basin!")
-    
-    clipped.to_file(clipped_streams, driver="GPKG")
-    print("Clipping successful")
-
-except Exception as e:
-    raise RuntimeError(f"Clipping failed: {e}")
-
-# --- Step 4: Calculate Drainage Density ---
-print("\n=== Calculating Drainage Density ===")
-try:
-    clipped = gpd.read_file(clipped_streams)
+        if basin_area_m2 < 10000:  # Less than 1ha
+            print(f"Small basin detected ({basin_area_m2:.2f} m²), applying buffer...")
+            basin_gdf.geometry = basin_gdf.geometry.buffer(50)  # 50m buffer
+            basin_area_m2 = basin_gdf.geometry.area.sum()
+
+        print(f"Basin area: {basin_area_m2:.2f} m² ({basin_area_m2/1e6:.3f} km²)")
+
+    except Exception as e:
+        print(f"\nWARNING: Basin processing failed ({e}). Creating test basin...")
+        # Create 1km² test basin in UTM Zone 46N
+        test_basin = gpd.GeoDataFrame(geometry=[Polygon([
+            (500000, 3000000),  # UTM coordinates for test area
+            (501000, 3000000),
+            (501000, 3001000),
+            (500000, 3001000)
+        ])], crs="EPSG:32646")
+        basin_gdf = test_basin
+        print("Created 1 km² test basin at UTM (500000,3000000)")
+
+    return basin_gdf
+
+def clip_geometries(geometries, polygon):
+    """Clip geometries to a polygon, returning the kept positions and clipped geometries.
+
+    An STRtree bbox query drops everything away from the polygon, segments the
+    prepared polygon fully contains are kept untouched, and only the few that
+    cross the boundary go through a true intersection.
+    """
+    shapely.prepare(polygon)
+    candidates = np.sort(shapely.STRtree(geometries).query(polygon))
+    inside = shapely.contains(polygon, geometries[candidates])
+
+    crossing = candidates[~inside]
+    pieces = shapely.intersection(geometries[crossing], polygon)
+    hit = ~shapely.is_empty(pieces)
+
+    positions = np.concatenate([candidates[inside], crossing[hit]])
+    clipped = np.concatenate([geometries[candidates[inside]], pieces[hit]])
+    order = np.argsort(positions, kind="stable")
+    return positions[order], clipped[order]
+
+def clip_streams(streams, basin_gdf):
+    """Clip the vectorized network to the basin"""
+    try:
+        basin = shapely.union_all(basin_gdf.geometry.values)
+        positions, clipped_geoms = clip_geometries(streams.geometry.values, basin)
+        clipped = streams.iloc[positions].set_geometry(clipped_geoms)
+        if len(clipped) == 0:
+            raise ValueError("No streams intersect the basin!")
+        print(f"Clipping successful: {len(clipped)} of {len(streams)} segments kept")
+        return clipped
+
+    except Exception as e:
+        raise RuntimeError(f"Clipping failed: {e}")
+
+def report_drainage_density(clipped, basin_gdf, output_label, show_plot=True):
+    """Print total length, area and drainage density, and plot the clipped network"""
+    print("\n=== Calculating Drainage Density ===")
+    try:
+        total_length_km = clipped.geometry.length.sum() / 1000
+        basin_area_km2 = basin_gdf.geometry.area.sum() / 1e6
+
+        drainage_density = total_length_km / basin_area_km2
+
+        print("\n=== Final Results ===")
+        print(f"📏 Total stream length: {total_length_km:.2f} km")
+        print(f"🗺️ Basin area: {basin_area_km2:.3f} km²")
+        print(f"🧮 Drainage density: {drainage_density:.4f} km/km²")
+        print(f"✅ Output saved to: {output_label}")
+
+        # Visualization
+        if show_plot:
+            fig, ax = plt.subplots(figsize=(10, 10))
+            basin_gdf.plot(ax=ax, color='lightgray', edgecolor='black')
+            clipped.plot(ax=ax, color='blue', linewidth=1)
+            plt.title(f"Drainage Density: {drainage_density:.2f} km/km²")
+            plt.show()
+
+        return drainage_density
+
+    except Exception as e:
+        raise RuntimeError(f"Calculation failed: {e}")
+
+# Row/column step for each D8 pointer value (Whitebox and ESRI encodings)
+D8_OFFSETS = {
+    "whitebox": {1: (-1, 1), 2: (0, 1), 4: (1, 1), 8: (1, 0),
+                 16: (1, -1), 32: (0, -1), 64: (-1, -1), 128: (-1, 0)},
+    "esri": {1: (0, 1), 2: (1, 1), 4: (1, 0), 8: (1, -1),
+             16: (0, -1), 32: (-1, -1), 64: (-1, 0), 128: (-1, 1)},
+}
+
+def d8_downstream(stream_mask, pointer, encoding="whitebox"):
+    """Row/column of each stream cell, the in-grid cell it drains to, and that
+    cell's stream index (-1 where the flow leaves the stream network)"""
+    rows, cols = np.nonzero(stream_mask)
+    codes = pointer[rows, cols].astype(np.int64)
+    step_r = np.zeros(256, dtype=np.int64)
+    step_c = np.zeros(256, dtype=np.int64)
+    for code, (dr, dc) in D8_OFFSETS[encoding].items():
+        step_r[code], step_c[code] = dr, dc
+
+    valid = (codes > 0) & (codes < 256)
+    codes = np.where(valid, codes, 0)
+    down_r, down_c = rows + step_r[codes], cols + step_c[codes]
+    n_rows, n_cols = stream_mask.shape
+    inside = valid & (step_r[codes] | step_c[codes]).astype(bool) \
+        & (down_r >= 0) & (down_r < n_rows) & (down_c >= 0) & (down_c < n_cols)
+
+    # Dense stream-cell numbering, so the network only costs memory per stream cell
+    cell_id = np.full(stream_mask.shape, -1, dtype=np.int64)
+    cell_id[rows, cols] = np.arange(len(rows))
+    down = np.full(len(rows), -1, dtype=np.int64)
+    down[inside] = cell_id[down_r[inside], down_c[inside]]
+    down_r[~inside] = -1
+    down_c[~inside] = -1
+    return rows, cols, down, down_r, down_c
+
+def pointer_jump(parent, weight):
+    """Root of every chain and the summed weight to reach it, in O(log n) vectorized steps"""
+    parent, weight = parent.copy(), weight.copy()
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent, weight
+        weight += weight[parent]
+        parent = grand
+
+def strahler_orders(link_down):
+    """Strahler order of each link, one vectorized pass per topological generation"""
+    from River_rebuild import topological_levels
+
+    n = len(link_down)
+    order, offsets = topological_levels(link_down)
+    has_down = link_down >= 0
+    # Upstream links grouped by the link they drain into (CSR layout)
+    upstream = np.flatnonzero(has_down)[np.argsort(link_down[has_down], kind="stable")]
+    counts = np.bincount(link_down[has_down], minlength=n)
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+
+    strahler = np.ones(n, dtype=np.int64)
+    for level in range(len(offsets) - 1):
+        links = order[offsets[level]:offsets[level + 1]]
+        links = links[counts[links] > 0]
+        if not len(links):
+            continue
+        lens = counts[links]
+        starts = np.repeat(indptr[links] - np.cumsum(lens) + lens, lens)
+        incoming = strahler[upstream[starts + np.arange(lens.sum())]]
+        seg = np.cumsum(lens) - lens
+        top = np.maximum.reduceat(incoming, seg)
+        n_top = np.add.reduceat((incoming == np.repeat(top, lens)).astype(np.int64), seg)
+        strahler[links] = top + (n_top > 1)
+    return strahler
+
+def trace_streams(stream_mask, pointer, transform, crs=None, encoding="whitebox"):
+    """Trace the D8 pointer over stream cells into links with exact shared junction nodes.
+
+    A link runs from a channel head or junction cell down to the cell before
+    the next junction, and ends on that junction's cell centre, so links meeting
+    at a confluence share the vertex exactly. As in raster_streams_to_vector,
+    outlet links end on the off-network cell they drain to. Attributes: LINK_ID,
+    DS_LINK (-1 at outlets), STRAHLER and NETWORK (LINK_ID of the outlet link).
+    """
+    rows, cols, down, down_r, down_c = d8_downstream(stream_mask, pointer, encoding)
+    n = len(rows)
+    has_down = down >= 0
+    indeg = np.bincount(down[has_down], minlength=n)
+
+    # Cells with exactly one inflow continue their upstream neighbour's link
+    is_start = indeg != 1
+    upstream = np.arange(n)
+    upstream[down[has_down]] = np.flatnonzero(has_down)
+    parent = np.where(is_start, np.arange(n), upstream)
+    head, position = pointer_jump(parent, (~is_start).astype(np.int64))
+
+    link_of_cell = np.cumsum(is_start) - 1
+    link = link_of_cell[head]
+    n_links = int(is_start.sum())
+
+    cell_order = np.lexsort((position, link))
+    last = cell_order[np.r_[np.flatnonzero(np.diff(link[cell_order])), n - 1]] if n else cell_order
+    tail = down[last]
+    link_down = np.where(tail >= 0, link[np.maximum(tail, 0)], -1)
+
+    # Vertices: each link's cells in flow order, then the cell it drains into
+    drains = down_r[last] >= 0
+    vertex_r = np.concatenate([rows[cell_order], down_r[last][drains]])
+    vertex_c = np.concatenate([cols[cell_order], down_c[last][drains]])
+    vertex_link = np.concatenate([link[cell_order], np.flatnonzero(drains)])
+    vertex_order = np.argsort(vertex_link, kind="stable")
+    vertex_link = vertex_link[vertex_order]
+    x, y = transform * (vertex_c[vertex_order] + 0.5, vertex_r[vertex_order] + 0.5)
+
+    # A single-cell link draining off the grid has no length; links ending on
+    # one become outlets
+    keep = np.bincount(vertex_link, minlength=n_links) >= 2
+    link_down[(link_down >= 0) & ~keep[np.maximum(link_down, 0)]] = -1
+    keep_vertex = keep[vertex_link]
+    lines = shapely.linestrings(np.column_stack([x, y])[keep_vertex],
+                                indices=(np.cumsum(keep) - 1)[vertex_link[keep_vertex]])
+
+    outlet, _ = pointer_jump(np.where(link_down >= 0, link_down, np.arange(n_links)),
+                             np.zeros(n_links, dtype=np.int64))
+    attrs = pd.DataFrame({
+        "LINK_ID": np.arange(n_links),
+        "DS_LINK": link_down,
+        "STRAHLER": strahler_orders(link_down),
+        "NETWORK": outlet,
+    })[keep]
+    return gpd.GeoDataFrame(attrs.reset_index(drop=True), geometry=lines, crs=crs)
+
+def trace_stream_raster(stream_raster_path, pointer_path):
+    """Trace a stream raster on disk (non-zero cells are streams) against its D8 pointer"""
+    with rasterio.open(stream_raster_path) as src:
+        stream_mask = src.read(1, masked=True).filled(0) > 0
+    with rasterio.open(pointer_path) as src:
+        pointer = src.read(1, masked=True).filled(0)
+        return trace_streams(stream_mask, pointer, src.transform, src.crs)
+
+def basin_metrics(streams, basins, id_column=batch_id_column):
+    """Stream length, area and drainage density for every basin polygon in one overlay.
+
+    Stream/basin pairs come from a single STRtree query; segments a basin
+    contains count at full length and only boundary-crossing pairs are
+    intersected before the lengths are summed per basin.
+    """
+    stream_geoms = streams.geometry.values
+    basin_geoms = basins.geometry.values
+    shapely.prepare(basin_geoms)
+    basin_idx, stream_idx = shapely.STRtree(stream_geoms).query(basin_geoms, predicate="intersects")
+
+    lengths = shapely.length(stream_geoms)[stream_idx]
+    crossing = ~shapely.contains(basin_geoms[basin_idx], stream_geoms[stream_idx])
+    lengths[crossing] = shapely.length(shapely.intersection(stream_geoms[stream_idx[crossing]],
+                                                            basin_geoms[basin_idx[crossing]]))
+
+    n = len(basins)
+    inside = lengths > 0  # segments only touching the boundary do not count
+    total_length_km = np.bincount(basin_idx, weights=lengths, minlength=n) / 1000
+    basin_area_km2 = shapely.area(basin_geoms) / 1e6
+    metrics = pd.DataFrame({
+        "Num_Segments": np.bincount(basin_idx[inside], minlength=n),
+        "Total_Length_km": total_length_km,
+        "Basin_Area_km2": basin_area_km2,
+        "Drainage_Density": total_length_km / basin_area_km2,
+    })
+    if "STRAHLER" in streams.columns:
+        max_order = np.zeros(n, dtype=np.int64)
+        np.maximum.at(max_order, basin_idx[inside], streams["STRAHLER"].to_numpy()[stream_idx[inside]])
+        metrics["Max_Strahler"] = max_order
+    if id_column in basins.columns:
+        metrics.insert(0, id_column, basins[id_column].to_numpy())
+    return metrics
+
+def run_basin_batch(streams, dem_crs, basins_path=None):
+    """Drainage metrics for every polygon of a HydroBASINS layer, saved to batch_table"""
+    basins_path = basins_path or batch_basins
+    print(f"\n=== Batch Basin Metrics: {basins_path} ===")
+    basins = read_table(basins_path, columns=[batch_id_column, "geometry"])
+    if basins.crs != dem_crs:
+        basins = basins.to_crs(dem_crs)
+    basins = basins.set_geometry(shapely.make_valid(basins.geometry.values))
+
+    metrics = basin_metrics(streams, basins)
+    write_table(metrics, batch_table)
+    covered = metrics["Total_Length_km"] > 0
+    print(f"📊 {covered.sum()} of {len(metrics)} basins contain streams")
+    print(f"✅ Basin metrics saved to: {batch_table}")
+    return metrics
+
+def threshold_stack(flow_acc_path, thresholds):
+    """Stream masks for every threshold from a single read of the accumulation raster.
+
+    Matches extract_streams: a cell is a stream where accumulation exceeds
+    the threshold.
+    """
+    with rasterio.open(flow_acc_path) as src:
+        acc = src.read(1, masked=True).filled(-np.inf)
+        profile = src.profile
+    stack = acc[None, :, :] > np.asarray(thresholds, dtype=float)[:, None, None]
+    return stack, profile
+
+def sweep_one(threshold, mask, pointer, profile, basin_gdf):
+    """Trace and clip one threshold's network, returning its drainage-density row"""
+    streams = trace_streams(mask, pointer, profile["transform"], profile["crs"])
+    positions, clipped_geoms = clip_geometries(streams.geometry.values,
+                                               shapely.union_all(basin_gdf.geometry.values))
+    clipped = streams.iloc[positions].set_geometry(clipped_geoms)
+    write_table(clipped, clipped_streams.replace(".parquet", f"_t{threshold}.parquet"))
+
     total_length_km = clipped.geometry.length.sum() / 1000
     basin_area_km2 = basin_gdf.geometry.area.sum() / 1e6
-    
-    drainage_density = total_length_km / basin_area_km2
-    
-    print("\n=== Final Results ===")
-    print(f"📏 Total stream length: {total_length_km:.2f} km")
-    print(f"🗺️ Basin area: {basin_area_km2:.3f} km²")
-    print(f"🧮 Drainage density: {drainage_density:.4f} km/km²")
-    print(f"✅ Output saved to: {clipped_streams}")
-    
-    # Visualization
-    fig, ax = plt.subplots(figsize=(10, 10))
-    basin_gdf.plot(ax=ax, color='lightgray', edgecolor='black')
-    clipped.plot(ax=ax, color='blue', linewidth=1)
-    plt.title(f"Drainage Density: {drainage_density:.2f} km/km²")
-    plt.show()
-
-except Exception as e:
-    raise RuntimeError(f"Calculation failed: {e}")
-
-print("\n=== Analysis Complete ===")
\ No newline at end of file
+    return {
+        "Threshold": threshold,
+        "Stream_Cells": int(mask.sum()),
+        "Num_Segments": len(clipped),
+        "Total_Length_km": round(total_length_km, 3),
+        "Basin_Area_km2": round(basin_area_km2, 3),
+        "Drainage_Density": total_length_km / basin_area_km2,
+    }
+
+def run_threshold_sweep(thresholds, workers=None):
+    """Drainage density for several thresholds from one flow accumulation read, run in parallel"""
+    print(f"\n=== Threshold Sweep: {thresholds} ===")
+    thresholds = sorted(thresholds)
+    stack, profile = threshold_stack(flow_acc, thresholds)
+    with rasterio.open(flow_dir) as src:
+        pointer = src.read(1, masked=True).filled(0)
+    basin_gdf = load_basin(basin_shp, profile["crs"])
+
+    with ThreadPoolExecutor(max_workers=workers or sweep_workers) as pool:
+        # Threads share the threshold stack and pointer grid instead of copying them to workers
+        rows = list(pool.map(lambda i: sweep_one(thresholds[i], stack[i], pointer, profile, basin_gdf),
+                             range(len(thresholds))))
+
+    table = pd.DataFrame(rows)
+    table.to_csv(sweep_table, index=False)
+    print(table.to_string(index=False))
+    print(f"✅ Sweep table saved to: {sweep_table}")
+    return table
+
+def main():
+    os.makedirs(base_dir, exist_ok=True)
+    if sweep_thresholds:
+        run_threshold_sweep(sweep_thresholds)
+        return
+
+    # --- Validate Inputs ---
+    print("\n=== Input Validation ===")
+    required_files = [flow_acc, flow_dir]
+    for f in required_files:
+        if not os.path.exists(f):
+            raise FileNotFoundError(f"Missing input file: {f}")
+        print(f"Found: {f}")
+
+    # --- DEM CRS Check ---
+    with rasterio.open(flow_acc) as src:
+        dem_crs = src.crs
+        print(f"\nDEM CRS: {dem_crs}")
+
+    # --- Step 1: Extract Streams ---
+    print("\n=== Extracting Streams ===")
+    try:
+        wbt.extract_streams(
+            flow_accum=flow_acc,
+            output=stream_raster,
+            threshold=3000
+        )
+
+        with rasterio.open(stream_raster) as src:
+            if src.read().max() == 0:
+                raise ValueError("No streams detected! Lower the threshold.")
+        print("Stream extraction successful")
+
+    except Exception as e:
+        raise RuntimeError(f"Stream extraction failed: {e}")
+
+    # --- Step 2: Vectorize Streams ---
+    print("\n=== Vectorizing Streams ===")
+    try:
+        streams = trace_stream_raster(stream_raster, flow_dir)
+        write_table(streams, stream_vector)
+        print(f"Vectorization successful: {len(streams)} links, "
+              f"max Strahler order {streams['STRAHLER'].max()}")
+
+    except Exception as e:
+        raise RuntimeError(f"Vectorization failed: {e}")
+
+    if batch_basins:
+        run_basin_batch(streams, dem_crs)
+        return
+
+    # --- Step 3: Process Basin with Robust Fallback ---
+    basin_gdf = load_basin(basin_shp, dem_crs)
+
+    # --- Clip Streams ---
+    clipped = clip_streams(streams, basin_gdf)
+    try:
+        write_table(clipped, clipped_streams)
+    except Exception as e:
+        raise RuntimeError(f"Clipping failed: {e}")
+
+    # --- Step 4: Calculate Drainage Density ---
+    report_drainage_density(clipped, basin_gdf, clipped_streams)
+
+    print("\n=== Analysis Complete ===")
+
+if __name__ == "__main__":
+    main()
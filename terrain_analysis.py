@@ -1,4 +1,11 @@
 import os
+import json
+import hashlib
+import shutil
+import tempfile
+import time
+import rasterio
+from rasterio.windows import Window
 from whitebox_workflows import WbEnvironment
 
 # 1️⃣ Setup Whitebox Workflows Environment
@@ -9,40 +16,268 @@ wbe.max_procs = -1  # Use all CPU cores by default
 # Paths
 input_dem = "DEM/outputs/COP30_VRT_DEM.tif"
 output_dir = "DEM/outputs"
-os.makedirs(output_dir, exist_ok=True)
-
-# 2️⃣ Load DEM
-dem = wbe.read_raster(input_dem)
-
-# 3️⃣ Fill Depressions
-# Breaching + filling is recommended, but we'll just fill for now
-dem_filled = wbe.fill_depressions(dem)
-filled_path = os.path.join(output_dir, "dem_filled.tif")
-wbe.write_raster(dem_filled, filled_path)
-
-# 4️⃣ Compute Slope (degrees)
-dem_slope = wbe.slope(dem_filled, units="degrees")
-slope_path = os.path.join(output_dir, "dem_slope.tif")
-wbe.write_raster(dem_slope, slope_path)
-
-# 5️⃣ Compute Aspect
-dem_aspect = wbe.aspect(dem_filled)
-aspect_path = os.path.join(output_dir, "dem_aspect.tif")
-wbe.write_raster(dem_aspect, aspect_path)
-
-# 6️⃣ Compute Multidirectional Hillshade
-dem_hillshade = wbe.multidirectional_hillshade(dem_filled, full_360_mode=True)
-hillshade_path = os.path.join(output_dir, "dem_hillshade.tif")
-wbe.write_raster(dem_hillshade, hillshade_path)
-
-# 7️⃣ Compute D8 Flow Direction (pointer)
-flow_dir = wbe.d8_pointer(dem_filled)
-fdir_path = os.path.join(output_dir, "dem_flowdir.tif")
-wbe.write_raster(flow_dir, fdir_path)
-
-# 8️⃣ Compute D8 Flow Accumulation
-flow_acc = wbe.qin_flow_accumulation(dem_filled, out_type="cells")
-flowacc_path = os.path.join(output_dir, "dem_flowacc.tif")
-wbe.write_raster(flow_acc, flowacc_path)
-
-print("✅ DEM hydrological processing completed using Whitebox Workflows.")
+
+# Tiled mode: process windows of tile_size x tile_size cells instead of the whole DEM
+tile_size = None  # e.g. 4096; None runs every tool on the full raster
+tile_halo = 2  # overlap for the local operators (slope/aspect/hillshade use a 5x5 window)
+# Only local operators are tiled; the global ones (fill, accumulation) depend on
+# the whole drainage network and always run on the full raster
+
+# Derivative cache: products are reused while the DEM and tool parameters are unchanged
+use_cache = True
+cache_dir = os.path.join(output_dir, "cache")
+cache_max_gb = 20  # least recently used entries are evicted above this size
+
+# Derived products: name -> (output file, input product, operator kind, tool, parameters)
+PRODUCTS = {
+    # 3️⃣ Fill Depressions
+    # Breaching + filling is recommended, but we'll just fill for now
+    "filled": ("dem_filled.tif", "dem", "global", "fill_depressions", {}),
+    # 4️⃣ Compute Slope (degrees)
+    "slope": ("dem_slope.tif", "filled", "local", "slope", {"units": "degrees"}),
+    # 5️⃣ Compute Aspect
+    "aspect": ("dem_aspect.tif", "filled", "local", "aspect", {}),
+    # 6️⃣ Compute Multidirectional Hillshade
+    "hillshade": ("dem_hillshade.tif", "filled", "local", "multidirectional_hillshade", {"full_360_mode": True}),
+    # 7️⃣ Compute D8 Flow Direction (pointer)
+    "flowdir": ("dem_flowdir.tif", "filled", "local", "d8_pointer", {}),
+    # 8️⃣ Compute D8 Flow Accumulation
+    "flowacc": ("dem_flowacc.tif", "filled", "global", "qin_flow_accumulation", {"out_type": "cells"}),
+}
+
+def product_tool(name):
+    """Callable running a product's Whitebox tool with its parameters"""
+    _, _, _, tool, params = PRODUCTS[name]
+    return lambda raster: getattr(wbe, tool)(raster, **params)
+
+def product_path(name):
+    """Path of a product on disk ("dem" is the input DEM)"""
+    if name == "dem":
+        return input_dem
+    return os.path.join(output_dir, PRODUCTS[name][0])
+
+def new_output(name):
+    """Output path for a product, unlinked first so cached copies sharing its inode stay intact"""
+    path = product_path(name)
+    if os.path.exists(path):
+        os.remove(path)
+    return path
+
+def run_monolithic(names=PRODUCTS):
+    """Run every tool on the whole raster, keeping only the rasters still needed in memory"""
+    names = list(names)
+    rasters = {}
+    for i, name in enumerate(names):
+        filename, source = PRODUCTS[name][:2]
+        if source not in rasters:
+            # 2️⃣ Load DEM (or a cached intermediate product)
+            rasters[source] = wbe.read_raster(product_path(source))
+        rasters[name] = product_tool(name)(rasters[source])
+        wbe.write_raster(rasters[name], new_output(name))
+        print(f"Written {filename}")
+
+        # Release rasters that no remaining product is derived from
+        needed = {PRODUCTS[later][1] for later in names[i + 1:]}
+        for key in [key for key in rasters if key not in needed]:
+            del rasters[key]
+
+def iter_tiles(width, height, size, halo):
+    """Yield (core window, read window with halo, core offset inside the read window)"""
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            core = Window(col, row, min(size, width - col), min(size, height - row))
+            r0, c0 = max(row - halo, 0), max(col - halo, 0)
+            r1 = min(row + core.height + halo, height)
+            c1 = min(col + core.width + halo, width)
+            yield core, Window(c0, r0, c1 - c0, r1 - r0), (row - r0, col - c0)
+
+def run_tool_on_array(tool, data, profile, transform, workdir):
+    """Round-trip one block through a temporary GeoTIFF so the Whitebox tool sees a normal raster"""
+    tile_in = os.path.join(workdir, "tile_in.tif")
+    tile_out = os.path.join(workdir, "tile_out.tif")
+    block_profile = dict(profile, driver="GTiff", width=data.shape[1], height=data.shape[0],
+                         transform=transform, count=1, compress=None, tiled=False)
+    block_profile.pop("blockxsize", None)
+    block_profile.pop("blockysize", None)
+    with rasterio.open(tile_in, "w", **block_profile) as dst:
+        dst.write(data, 1)
+    wbe.write_raster(tool(wbe.read_raster(tile_in)), tile_out)
+    with rasterio.open(tile_out) as src:
+        return src.read(1), src.profile
+
+def open_output(path, src_profile, block_profile):
+    """Full-size output raster matching the source grid and the tool's dtype/nodata"""
+    profile = dict(src_profile, driver="GTiff", dtype=block_profile["dtype"], nodata=block_profile["nodata"],
+                   count=1, tiled=True, blockxsize=512, blockysize=512, compress="deflate", BIGTIFF="IF_SAFER")
+    return rasterio.open(path, "w", **profile)
+
+def run_local_tiled(name, size=None, halo=None):
+    """Local operator over overlapping windows; the halo makes tile seams exact"""
+    size = size or tile_size
+    halo = tile_halo if halo is None else halo
+    source, tool = PRODUCTS[name][1], product_tool(name)
+
+    with rasterio.open(product_path(source)) as src, tempfile.TemporaryDirectory() as workdir:
+        dst = None
+        try:
+            for core, read, (dr, dc) in iter_tiles(src.width, src.height, size, halo):
+                data = src.read(1, window=read)
+                result, block_profile = run_tool_on_array(tool, data, src.profile,
+                                                          src.window_transform(read), workdir)
+                if dst is None:
+                    dst = open_output(new_output(name), src.profile, block_profile)
+                dst.write(result[dr:dr + core.height, dc:dc + core.width], 1, window=core)
+        finally:
+            if dst is not None:
+                dst.close()
+    print(f"Written {PRODUCTS[name][0]} (tiled)")
+
+def run_tiled(names=PRODUCTS):
+    """Local operators tiled; global operators on the full raster so their output is exact"""
+    for name in names:
+        if PRODUCTS[name][2] == "local":
+            run_local_tiled(name)
+        else:
+            run_monolithic([name])
+
+def execution_mode(kind):
+    """How a product of this kind is built under the current settings, for cache keys.
+
+    Tiled local products depend on the tile size and halo; global products
+    are always built on the full raster.
+    """
+    if tile_size and kind == "local":
+        return ["tiled", tile_size, tile_halo]
+    return ["monolithic"]
+
+class DerivativeCache:
+    """Content-addressed store for derived rasters.
+
+    A product's key hashes its tool, parameters and the key of the product
+    it is derived from, down to the content hash of the input DEM, so a
+    change anywhere upstream invalidates everything below it. Entries live
+    in cache_dir and are hard-linked (or copied) to the usual output names.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(root, "manifest.json")
+        os.makedirs(root, exist_ok=True)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {"inputs": {}, "entries": {}}
+
+    def input_key(self, path):
+        """Content hash of an input raster (plus its VRT sources), remembered by size and mtime"""
+        with rasterio.open(path) as src:
+            files = src.files or [path]
+        stamp = [[f, os.path.getsize(f), os.path.getmtime(f)] for f in files]
+        known = self.manifest["inputs"].get(path)
+        if known and known["stamp"] == stamp:
+            return known["hash"]
+
+        print(f"Hashing {path}...")
+        digest = hashlib.sha256()
+        for f in files:
+            with open(f, "rb") as fh:
+                for block in iter(lambda: fh.read(1 << 24), b""):
+                    digest.update(block)
+        self.manifest["inputs"][path] = {"stamp": stamp, "hash": digest.hexdigest()}
+        return digest.hexdigest()
+
+    def product_key(self, name, source_key):
+        _, _, kind, tool, params = PRODUCTS[name]
+        spec = json.dumps([name, tool, params, source_key, execution_mode(kind)], sort_keys=True)
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+    def _entry_path(self, name, key):
+        return os.path.join(self.root, f"{name}-{key[:16]}.tif")
+
+    def fetch(self, name, key):
+        """Put a cached product at its output path; False if it has to be rebuilt"""
+        entry = self.manifest["entries"].get(key)
+        path = self._entry_path(name, key)
+        if entry is None or not os.path.exists(path):
+            return False
+        entry["last_used"] = time.time()
+        link_or_copy(path, new_output(name))
+        return True
+
+    def store(self, name, key):
+        """Add a freshly built product to the cache, evicting the oldest entries if over budget"""
+        path = self._entry_path(name, key)
+        link_or_copy(product_path(name), path)
+        self.manifest["entries"][key] = {"name": name, "size": os.path.getsize(path), "last_used": time.time()}
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = self.manifest["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            path = self._entry_path(entry["name"], key)
+            if os.path.exists(path):
+                os.remove(path)
+            total -= entry["size"]
+            del entries[key]
+            print(f"Evicted cached {entry['name']} ({entry['size'] / 1e6:.1f} MB)")
+
+    def save(self):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+def link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def with_dependencies(names):
+    """Requested products plus everything they are derived from, in build order"""
+    needed = set(names)
+    for name in reversed(list(PRODUCTS)):
+        if name in needed and PRODUCTS[name][1] != "dem":
+            needed.add(PRODUCTS[name][1])
+    return [name for name in PRODUCTS if name in needed]
+
+def build_products(names=PRODUCTS):
+    """Build the requested products, rebuilding only those whose inputs changed"""
+    names = with_dependencies(names)
+    run = run_tiled if tile_size else run_monolithic
+    if not use_cache:
+        run(names)
+        return
+
+    cache = DerivativeCache(cache_dir, cache_max_gb * 1024 ** 3)
+    keys = {"dem": cache.input_key(input_dem)}
+    stale = []
+    for name in names:
+        keys[name] = cache.product_key(name, keys[PRODUCTS[name][1]])
+        if cache.fetch(name, keys[name]):
+            print(f"Using cached {PRODUCTS[name][0]}")
+        else:
+            stale.append(name)
+
+    run(stale)
+    for name in stale:
+        cache.store(name, keys[name])
+    cache.evict()
+    cache.save()
+
+def main():
+    os.makedirs(output_dir, exist_ok=True)
+    build_products()
+    print("✅ DEM hydrological processing completed using Whitebox Workflows.")
+
+if __name__ == "__main__":
+    main()